@@ -0,0 +1,71 @@
+import argparse
+import json
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+
+class Case:
+    def __init__(self, name: str, fn: Callable[[], object]):
+        self.name = name
+        self.fn = fn
+
+    def run(self, min_time: float = 0.2) -> Dict[str, float]:
+        timer = timeit.Timer(self.fn)
+        number, _ = timer.autorange()
+        number = max(1, int(number * min_time / 0.2))
+        best = min(timer.repeat(repeat=3, number=number)) / number
+
+        tracemalloc.start()
+        try:
+            self.fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "ops_per_sec": 1 / best,
+            "us_per_op": best * 1e6,
+            "peak_kib": peak / 1024,
+        }
+
+
+def _fmt_row(name: str, res: Dict[str, float], base: Optional[Dict[str, float]]) -> str:
+    row = (
+        f"{name:<42} {res['ops_per_sec']:>12,.0f} {res['us_per_op']:>12,.1f}"
+        f" {res['peak_kib']:>10,.1f}"
+    )
+    if base:
+        row += f" {base['us_per_op'] / res['us_per_op']:>8.2f}x"
+    return row
+
+
+def main(cases: List[Case], argv=None):
+    """Runs the cases and prints ops/sec, time and peak allocations per op.
+
+    ``--save`` writes the results as JSON, ``--compare`` prints the speedup
+    against a previously saved run so regressions are visible.
+    """
+    args = argparse.ArgumentParser()
+    args.add_argument("-k", dest="filter", default="", help="run matching cases")
+    args.add_argument("--min-time", type=float, default=0.2)
+    args.add_argument("--save", help="write results to this JSON file")
+    args.add_argument("--compare", help="compare with results from this JSON file")
+    opts = args.parse_args(argv)
+
+    baseline = {}
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+
+    print(f"{'case':<42} {'ops/sec':>12} {'us/op':>12} {'peak KiB':>10}")
+    results = {}
+    for case in cases:
+        if opts.filter not in case.name:
+            continue
+        results[case.name] = case.run(opts.min_time)
+        print(_fmt_row(case.name, results[case.name], baseline.get(case.name)))
+
+    if opts.save:
+        with open(opts.save, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,53 @@
+"""Cold start benchmarks: package import and first decoration.
+
+Run with ``python -m benchmarks.import_time`` (``-h`` for options). Every
+case starts a fresh interpreter, so the numbers include the interpreter's
+own start up; ``cold/python`` is that baseline. ``-X importtime`` shows
+where the time goes within an import.
+"""
+
+import subprocess
+import sys
+
+from benchmarks.harness import Case, main
+
+_DECORATE = """
+from pydantic import BaseModel
+from pydantic_prompter import Prompter
+
+class Answer(BaseModel):
+    text: str
+
+@Prompter(llm="{llm}", model_name="{model}")
+def answer(question) -> Answer:
+    '''
+    - user: {{question}}
+    '''
+"""
+
+_CALL = _DECORATE.replace('llm="{llm}"', 'llm="mock"') + "\nanswer(question='hi')\n"
+
+
+def _python(code: str):
+    return lambda: subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def _cases():
+    return [
+        Case("cold/python", _python("pass")),
+        Case("cold/import_pydantic", _python("import pydantic")),
+        Case("cold/import_package", _python("import pydantic_prompter")),
+        Case(
+            "cold/decorate/openai",
+            _python(_DECORATE.format(llm="openai", model="gpt-3.5-turbo")),
+        ),
+        Case(
+            "cold/decorate/bedrock",
+            _python(_DECORATE.format(llm="bedrock", model="anthropic.claude-v2")),
+        ),
+        Case("cold/first_call/mock", _python(_CALL.format(model="mock"))),
+    ]
+
+
+if __name__ == "__main__":
+    main(_cases())
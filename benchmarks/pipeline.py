@@ -0,0 +1,270 @@
+"""Per-stage benchmarks of the prompt to object pipeline.
+
+Run with ``python -m benchmarks.pipeline`` (``-h`` for options). Every
+provider runs through the offline ``mock`` provider or only builds prompts,
+so no network access or credentials are needed.
+"""
+
+import json
+from typing import Dict, List, Optional
+
+from fix_busted_json import largest_json, repair_json
+from pydantic import BaseModel, Field
+
+from benchmarks.harness import Case, main
+from pydantic_prompter import Prompter, serializer
+from pydantic_prompter.common import LLMDataAndResult, Message
+from pydantic_prompter.llm_providers.bedrock_anthropic import BedRockAnthropic
+from pydantic_prompter.llm_providers.bedrock_base import BedRock
+from pydantic_prompter.llm_providers.bedrock_cohere import BedRockCohere
+from pydantic_prompter.llm_providers.mock import synthesize
+from pydantic_prompter.llm_providers.openai import OpenAI
+from pydantic_prompter.message_plan import parse_messages
+
+
+class Small(BaseModel):
+    name: str = Field(description="the name")
+    children: List[str] = Field(description="list of my children")
+
+
+class Address(BaseModel):
+    street: str
+    city: str
+    country: str = Field(description="ISO country code")
+    zip_code: Optional[str] = None
+
+
+class Person(BaseModel):
+    first_name: str
+    last_name: str
+    age: int
+    email: Optional[str] = None
+    addresses: List[Address]
+    tags: Dict[str, str] = {}
+
+
+class Entry(BaseModel):
+    id: str
+    name: str
+    reason: str = Field(description="Why this entry fits the query", default="")
+    score: float
+    people: List[Person]
+
+
+class Large(BaseModel):
+    title: str = Field(description="Title describing the list of entries")
+    summary: str
+    entries: List[Entry]
+    owner: Person
+    reviewers: List[Person]
+    metadata: Dict[str, str] = {}
+
+
+class PydanticMessage(BaseModel):
+    """The pydantic message carrier used before, kept for comparison"""
+
+    role: str
+    content: str
+
+
+class PydanticLLMData(BaseModel):
+    inputs: Dict
+    messages: Optional[List[PydanticMessage]] = None
+    raw_result: Optional[str] = None
+    clean_result: Optional[str] = None
+    timings: Dict[str, float] = {}
+    usage: Dict[str, int] = {}
+
+
+def _carriers(message_cls, data_cls, pairs, inputs):
+    # what a call does with its carriers: build, fill, turn into provider dicts
+    llm_data = data_cls(inputs=inputs)
+    llm_data.messages = [message_cls(role=r, content=c) for r, c in pairs]
+    llm_data.raw_result = llm_data.clean_result = "{}"
+    return [m.model_dump() for m in llm_data.messages]
+
+
+SMALL_DOC = """
+    - system: you are a writer
+    - user: hi, my name is {name} and my children are called, aa, bb, cc
+    - user: what is my name and my children name
+    """
+SMALL_DOC_JINJA = SMALL_DOC.replace("{name}", "{{ name }}")
+LARGE_DOC = SMALL_DOC + "".join(
+    f"    - {role}: turn {i} says {{name}} and then {{query}}\n"
+    for i, role in zip(range(40), ["user", "assistant"] * 20)
+)
+LARGE_DOC_JINJA = LARGE_DOC.replace("{name}", "{{ name }}").replace(
+    "{query}", "{{ query }}"
+)
+
+SMALL_INPUTS = {"name": "Ofer", "query": "Martial Arts, Action"}
+LARGE_INPUTS = {
+    "name": "Ofer " * 200,
+    "query": json.dumps(
+        [{"id": str(i), "text": "lorem ipsum " * 40} for i in range(50)]
+    ),
+}
+
+
+def _prompter(doc: str, return_cls, jinja: bool, llm="mock", model_name="mock"):
+    def function(name, query=None):
+        pass
+
+    function.__doc__ = doc
+    function.__annotations__["return"] = return_cls
+    return Prompter(llm=llm, model_name=model_name, jinja=jinja)(function)
+
+
+def _large_response(entries: int) -> dict:
+    value = synthesize(Large.model_json_schema(mode="serialization"))
+    value["entries"] = value["entries"] * entries
+    return value
+
+
+def _small_response() -> dict:
+    return {"name": "Ofer", "children": ["aa", "bb", "cc"]}
+
+
+def _cases() -> List[Case]:
+    cases = []
+    sizes = {
+        "small": (SMALL_DOC, SMALL_DOC_JINJA, SMALL_INPUTS, Small, _small_response()),
+        "large": (
+            LARGE_DOC,
+            LARGE_DOC_JINJA,
+            LARGE_INPUTS,
+            Large,
+            _large_response(200),
+        ),
+    }
+    for size, (doc, doc_jinja, inputs, model, response) in sizes.items():
+        fmt = _prompter(doc, model, jinja=False)
+        jinja = _prompter(doc_jinja, model, jinja=True)
+        messages = fmt._parse_function_to_messages(**inputs)
+        rendered = "\n".join(f"- {m.role}: {m.content}" for m in messages)
+        pairs = [(m.role, m.content) for m in messages]
+        schema = fmt.parser.llm_schema()
+        response_json = json.dumps(response)
+        wrapped = f"Sure! <json>```{json.dumps(response, indent=2)}```</json> Bye"
+        envelope = json.dumps({"content": [{"type": "text", "text": response_json}]})
+
+        cohere = BedRockCohere("cohere.command-text-v14", fmt.parser)
+        anthropic = BedRockAnthropic("anthropic.claude-v2", fmt.parser)
+        openai = OpenAI("gpt-3.5-turbo", fmt.parser)
+        # the large prompt is past any real context window, time the body anyway
+        anthropic.context_window = openai.context_window = None
+
+        def cast(parser=fmt.parser, clean=response_json):
+            parser.cast_result(LLMDataAndResult(inputs={}, clean_result=clean))
+
+        cases += [
+            Case(
+                f"render/format/{size}",
+                lambda f=fmt, i=inputs: f._parse_function_to_messages(**i),
+            ),
+            Case(
+                f"render/jinja/{size}",
+                lambda f=jinja, i=inputs: f._parse_function_to_messages(**i),
+            ),
+            Case(f"roles/regex/{size}", lambda r=rendered: parse_messages(r)),
+            Case(
+                f"roles/message_construction/{size}",
+                lambda p=pairs: [Message(role=r, content=c) for r, c in p],
+            ),
+            Case(
+                f"envelope/slotted/{size}",
+                lambda p=pairs, i=inputs: _carriers(Message, LLMDataAndResult, p, i),
+            ),
+            Case(
+                f"envelope/pydantic/{size}",
+                lambda p=pairs, i=inputs: _carriers(
+                    PydanticMessage, PydanticLLMData, p, i
+                ),
+            ),
+            Case(
+                f"schema/generate/{size}",
+                lambda m=model: m.model_json_schema(mode="serialization"),
+            ),
+            Case(f"schema/cached/{size}", lambda f=fmt: f.parser.llm_schema()),
+            Case(
+                f"provider/bedrock_build_prompt/{size}",
+                lambda m=messages, s=schema, p=cohere: p._build_prompt(m, s),
+            ),
+            Case(
+                f"provider/anthropic_fix_messages/{size}",
+                lambda m=messages, p=anthropic: p.fix_messages(
+                    [x.model_dump() for x in m]
+                ),
+            ),
+            Case(
+                f"provider/anthropic_body/{size}",
+                lambda m=messages, s=schema, p=anthropic: p._body(m, s),
+            ),
+            Case(
+                f"provider/preflight/{size}",
+                lambda m=messages, s=schema, p=openai: p.preflight(m, s),
+            ),
+            Case(
+                f"provider/openai_format/{size}",
+                lambda m=messages, p=openai: p.to_openai_format(m),
+            ),
+            Case(
+                f"response/clean_result/{size}",
+                lambda w=wrapped: BedRock.clean_result(w),
+            ),
+            Case(
+                f"response/decode_envelope/{size}",
+                lambda e=envelope: BedRock.decode_envelope(e),
+            ),
+            Case(f"response/largest_json/{size}", lambda e=envelope: largest_json(e)),
+            Case(f"response/repair_json/{size}", lambda e=envelope: repair_json(e)),
+            Case(f"response/cast_result/{size}", cast),
+            Case(
+                f"response/validate_json/{size}",
+                lambda m=model, c=response_json: m.model_validate_json(c),
+            ),
+            Case(
+                f"response/validate_dict/{size}",  # the lenient fallback
+                lambda m=model, c=response_json: m(**json.loads(c, strict=False)),
+            ),
+            Case(
+                f"end_to_end/mock/{size}",
+                lambda i=inputs, f=_prompter(doc, model, jinja=False): f(**i),
+            ),
+        ]
+    body = anthropic._body(messages, schema)
+    envelope = envelope.encode()
+    for backend in (serializer.JsonSerializer(), serializer.OrjsonSerializer()):
+        if backend.name == "orjson" and serializer.orjson is None:
+            continue
+        cases += [
+            Case(
+                f"serializer/{backend.name}/dumps_body", lambda b=backend: b.dumps(body)
+            ),
+            Case(
+                f"serializer/{backend.name}/loads_envelope",
+                lambda b=backend: b.loads(envelope),
+            ),
+        ]
+
+    # multi-hundred-KB outputs only go through the response stages
+    response_json = json.dumps(_large_response(2000), indent=2)
+    wrapped = f"Sure! <json>```{response_json}```</json> Bye <json_schema>{{}}"
+    envelope = json.dumps({"content": [{"type": "text", "text": response_json}]})
+    parser = _prompter(LARGE_DOC, Large, jinja=False).parser
+    cases += [
+        Case("response/clean_result/xl", lambda: BedRock.clean_result(wrapped)),
+        Case("response/decode_envelope/xl", lambda: BedRock.decode_envelope(envelope)),
+        Case(
+            "response/cast_result/xl",
+            lambda: parser.cast_result(
+                LLMDataAndResult(inputs={}, clean_result=response_json)
+            ),
+        ),
+    ]
+    return cases
+
+
+if __name__ == "__main__":
+    main(_cases())
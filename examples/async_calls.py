@@ -0,0 +1,28 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from pydantic_prompter import Prompter
+
+
+class Hi(BaseModel):
+    response: str
+
+
+@Prompter(llm="openai", jinja=False, model_name="gpt-3.5-turbo")
+def funct(hello) -> Hi:
+    """
+    - user: say {hello}
+    """
+
+
+async def main():
+    results = await asyncio.gather(
+        funct.acall(hello="hi"),
+        funct.acall(hello="hello"),
+    )
+    print(results)
+
+
+asyncio.run(main())
+# >>> [Hi(response='Hi there!'), Hi(response='Hello!')]
@@ -1,9 +1,15 @@
 import abc
 import json
 from json import JSONDecodeError
-from typing import Dict, Any
-
-from pydantic import ValidationError, ConfigDict
+from typing import Dict, Any, Optional
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    TypeAdapter,
+    ValidationError,
+    create_model,
+)
 
 from pydantic_prompter.common import logger, LLMDataAndResult
 from pydantic_prompter.exceptions import (
@@ -11,6 +17,35 @@ from pydantic_prompter.exceptions import (
 )
 
 
+def error_summary(error: Exception, limit: int = 10) -> str:
+    """One line per validation problem, short enough to send back to the LLM"""
+    if isinstance(error, FailedToCastLLMResult) and error.args:
+        error = error.args[0]
+    if isinstance(error, ValidationError):
+        lines = [
+            f"{'.'.join(str(part) for part in e['loc']) or 'root'}: {e['msg']}"
+            for e in error.errors()[:limit]
+        ]
+        if error.error_count() > limit:
+            lines.append(f"... and {error.error_count() - limit} more")
+        return "\n".join(lines)
+    return str(error)
+
+
+def _loads(text: str) -> Any:
+    """Strict parse first, the model text is only repaired when that fails"""
+    try:
+        return json.loads(text, strict=False)
+    except JSONDecodeError as e:
+        from fix_busted_json import repair_json
+
+        try:
+            repaired = repair_json(text)
+        except Exception:
+            raise e
+        return json.loads(repaired, strict=False)
+
+
 class AnnotationParser:
     @classmethod
     def get_parser(cls, function) -> "AnnotationParser":
@@ -40,10 +75,25 @@ class AnnotationParser:
     def llm_schema(self) -> dict:
         raise NotImplementedError
 
+    def llm_schema_json(self) -> str:
+        return json.dumps(self.llm_schema(), indent=4)
+
     @abc.abstractmethod
     def cast_result(self, llm_data: LLMDataAndResult):
         raise NotImplementedError
 
+    def cast_partial(self, fields: Dict[str, Any]) -> Optional[BaseModel]:
+        """Builds a partial result from the fields streamed so far"""
+        return None
+
+    def repair_result(self, llm_data: LLMDataAndResult) -> bool:
+        """Patches a result that failed to cast without asking the LLM again.
+
+        Returns True when ``llm_data`` now holds a result, in which case
+        ``clean_result`` holds the patched output.
+        """
+        return False
+
     @property
     @abc.abstractmethod
     def prompts_path(self):
@@ -57,6 +107,10 @@ class PydanticParser(AnnotationParser):
     def __init__(self, function):
         super().__init__(function)
         self.return_cls.model_config = ConfigDict(coerce_numbers_to_str=True)
+        # the schema of a model never changes, generate it once per parser
+        self._schema: Optional[dict] = None
+        self._schema_json: Optional[str] = None
+        self._partial_cls = None
 
     @property
     def prompts_path(self):
@@ -71,18 +125,89 @@ class PydanticParser(AnnotationParser):
         }
 
     def llm_schema(self) -> dict:
-        return_scheme = self.return_cls.model_json_schema(mode="serialization")
-        return self.pydantic_schema(return_scheme)
+        if self._schema is None:
+            return_scheme = self.return_cls.model_json_schema(mode="serialization")
+            self._schema = self.pydantic_schema(return_scheme)
+        return self._schema
+
+    def llm_schema_json(self) -> str:
+        if self._schema_json is None:
+            self._schema_json = json.dumps(self.llm_schema(), indent=4)
+        return self._schema_json
+
+    def cast_partial(self, fields: Dict[str, Any]) -> Optional[BaseModel]:
+        """Validates the fields present so far, missing fields are left unset"""
+        if self._partial_cls is None:
+            self._partial_cls = create_model(
+                f"Partial{self.return_cls.__name__}",
+                **{
+                    name: (Optional[field.annotation], None)
+                    for name, field in self.return_cls.model_fields.items()
+                },
+            )
+        try:
+            partial = self._partial_cls(**fields)
+        except ValidationError:
+            return None
+        return self.return_cls.model_construct(
+            **{name: getattr(partial, name) for name in partial.model_fields_set}
+        )
 
     def cast_result(self, llm_data: LLMDataAndResult) -> LLMDataAndResult:
         try:
-            j = json.loads(llm_data.clean_result, strict=False)
+            # parse and validate in one pass without an intermediate dict
+            llm_data.result = self.return_cls.model_validate_json(llm_data.clean_result)
+            return llm_data
+        except ValidationError:
+            pass  # lenient path: control characters, busted JSON, python mode
+        try:
+            j = _loads(llm_data.clean_result)
             res = self.return_cls(**j)
             llm_data.result = res
         except (ValidationError, JSONDecodeError) as e:
             llm_data.error = FailedToCastLLMResult(e)
         return llm_data
 
+    def repair_result(self, llm_data: LLMDataAndResult) -> bool:
+        try:
+            data = _loads(llm_data.clean_result)
+        except JSONDecodeError:
+            return False
+        if not isinstance(data, dict):
+            return False
+        fields = self.return_cls.model_fields
+        if len(data) == 1 and not fields.keys() & data.keys():
+            # the object wrapped in its name, e.g. {"PersonalInfo": {...}}
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict):
+                data = inner
+        try:
+            llm_data.result = self.return_cls(**data)
+        except ValidationError as e:
+            for error in e.errors():
+                if len(error["loc"]) != 1 or error["loc"][0] not in fields:
+                    continue
+                name = error["loc"][0]
+                if error["type"] == "list_type":
+                    data[name] = [data[name]]
+                elif error["type"] == "missing" and _accepts_none(fields[name]):
+                    data[name] = None
+            try:
+                llm_data.result = self.return_cls(**data)
+            except ValidationError:
+                return False
+        llm_data.clean_result = json.dumps(data)
+        llm_data.error = None
+        return True
+
+
+def _accepts_none(field) -> bool:
+    try:
+        TypeAdapter(field.annotation).validate_python(None)
+    except ValidationError:
+        return False
+    return True
+
 
 class SimpleStringParser(AnnotationParser):
     def llm_schema(self) -> dict:
@@ -0,0 +1,78 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, Optional
+
+from pydantic import BaseModel
+
+DEFAULT_CONCURRENCY = 8
+
+
+class BatchItem(BaseModel):
+    index: int
+    inputs: Dict[str, Any]
+    result: Optional[Any] = None
+    error: Optional[Any] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _run(call: Callable, index: int, inputs: Dict[str, Any]) -> BatchItem:
+    try:
+        return BatchItem(index=index, inputs=inputs, result=call(**inputs))
+    except Exception as e:
+        return BatchItem(index=index, inputs=inputs, error=e)
+
+
+async def _arun(acall: Callable, index: int, inputs: Dict[str, Any]) -> BatchItem:
+    try:
+        return BatchItem(index=index, inputs=inputs, result=await acall(**inputs))
+    except Exception as e:
+        return BatchItem(index=index, inputs=inputs, error=e)
+
+
+def imap(
+    call: Callable, inputs: Iterable[Dict[str, Any]], concurrency: int
+) -> Iterator[BatchItem]:
+    """Yields a BatchItem per input as soon as it completes.
+
+    At most ``concurrency`` calls are in flight, and inputs are consumed
+    lazily so very large (or generated) input sets are never materialized.
+    """
+    todo = enumerate(inputs)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = {
+            pool.submit(_run, call, index, kwargs)
+            for index, kwargs in itertools.islice(todo, concurrency)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, kwargs in itertools.islice(todo, 1):
+                    pending.add(pool.submit(_run, call, index, kwargs))
+                yield future.result()
+
+
+async def aimap(
+    acall: Callable, inputs: Iterable[Dict[str, Any]], concurrency: int
+) -> AsyncIterator[BatchItem]:
+    """Async counterpart of ``imap`` running on the current event loop"""
+    todo = enumerate(inputs)
+    pending = {
+        asyncio.ensure_future(_arun(acall, index, kwargs))
+        for index, kwargs in itertools.islice(todo, concurrency)
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                for index, kwargs in itertools.islice(todo, 1):
+                    pending.add(asyncio.ensure_future(_arun(acall, index, kwargs)))
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,250 @@
+import abc
+import json
+import os
+import time
+import uuid
+from typing import Callable, Dict, Iterator, List, Optional
+
+from pydantic_prompter.common import get_settings, logger
+from pydantic_prompter.llm_providers.base import LLM
+
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class BulkBackend(abc.ABC):
+    """Submits batch inference files and fetches their results"""
+
+    @abc.abstractmethod
+    def submit(self, llm: LLM, records: List[dict]) -> str:
+        """Uploads the input records and returns the job id"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def status(self, job_id: str) -> str:
+        """``running``, ``completed`` or ``failed``"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def results(self, job_id: str) -> Iterator[dict]:
+        """Yields the output records of a completed job"""
+        raise NotImplementedError
+
+
+def _jsonl(records: List[dict]) -> bytes:
+    return "".join(json.dumps(record) + "\n" for record in records).encode()
+
+
+class LocalBackend(BulkBackend):
+    """Filesystem stand-in for a provider batch API, for offline runs.
+
+    Every job is a directory under ``root`` holding ``input.jsonl``. The
+    job completes once ``output.jsonl`` appears next to it, written by
+    whatever processes the input, or, when ``respond`` is given, by mapping
+    every input record through it on the first poll (e.g.
+    ``Mock.batch_respond``).
+    """
+
+    def __init__(self, root: str, respond: Optional[Callable[[dict], dict]] = None):
+        self.root = root
+        self.respond = respond
+
+    def _path(self, job_id: str, name: str) -> str:
+        return os.path.join(self.root, job_id, name)
+
+    def submit(self, llm: LLM, records: List[dict]) -> str:
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, job_id))
+        with open(self._path(job_id, "input.jsonl"), "wb") as f:
+            f.write(_jsonl(records))
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        output = self._path(job_id, "output.jsonl")
+        if not os.path.exists(output) and self.respond is not None:
+            with open(self._path(job_id, "input.jsonl")) as f:
+                records = [self.respond(json.loads(line)) for line in f if line.strip()]
+            with open(output + ".tmp", "wb") as f:
+                f.write(_jsonl(records))
+            os.replace(output + ".tmp", output)
+        return COMPLETED if os.path.exists(output) else RUNNING
+
+    def results(self, job_id: str) -> Iterator[dict]:
+        with open(self._path(job_id, "output.jsonl")) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class OpenAIBatchBackend(BulkBackend):
+    """OpenAI Batch API, results within the 24h completion window"""
+
+    _STATUS = {
+        "completed": COMPLETED,
+        "failed": FAILED,
+        "expired": FAILED,
+        "cancelled": FAILED,
+    }
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def _client(self):
+        if self.client is None:
+            from openai import OpenAI
+
+            self.client = OpenAI(api_key=get_settings().openai_api_key)
+        return self.client
+
+    def submit(self, llm: LLM, records: List[dict]) -> str:
+        client = self._client()
+        upload = client.files.create(
+            file=("batch.jsonl", _jsonl(records)), purpose="batch"
+        )
+        job = client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return job.id
+
+    def status(self, job_id: str) -> str:
+        return self._STATUS.get(self._client().batches.retrieve(job_id).status, RUNNING)
+
+    def results(self, job_id: str) -> Iterator[dict]:
+        client = self._client()
+        job = client.batches.retrieve(job_id)
+        for file_id in (job.output_file_id, job.error_file_id):
+            if file_id:
+                for line in client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class BedrockBatchBackend(BulkBackend):
+    """Bedrock batch inference (``CreateModelInvocationJob``).
+
+    The input file is uploaded under ``input_s3_uri`` and Bedrock writes the
+    results under ``output_s3_uri``, ``role_arn`` must allow Bedrock to read
+    and write both.
+    """
+
+    _STATUS = {
+        "Completed": COMPLETED,
+        "PartiallyCompleted": COMPLETED,
+        "Failed": FAILED,
+        "Stopped": FAILED,
+        "Expired": FAILED,
+    }
+
+    def __init__(
+        self,
+        input_s3_uri: str,
+        output_s3_uri: str,
+        role_arn: str,
+        session=None,
+    ):
+        self.input_s3_uri = input_s3_uri.rstrip("/")
+        self.output_s3_uri = output_s3_uri.rstrip("/")
+        self.role_arn = role_arn
+        self.session = session
+
+    def _session(self):
+        if self.session is None:
+            import boto3
+
+            settings = get_settings()
+            self.session = boto3.Session(
+                aws_access_key_id=settings.aws_access_key_id,
+                aws_secret_access_key=settings.aws_secret_access_key,
+                aws_session_token=settings.aws_session_token,
+                profile_name=settings.aws_profile,
+                region_name=settings.aws_default_region,
+            )
+        return self.session
+
+    @staticmethod
+    def _split(uri: str):
+        bucket, _, key = uri[len("s3://") :].partition("/")
+        return bucket, key
+
+    def submit(self, llm: LLM, records: List[dict]) -> str:
+        name = f"pydantic-prompter-{uuid.uuid4().hex[:12]}"
+        bucket, prefix = self._split(f"{self.input_s3_uri}/{name}.jsonl")
+        self._session().client("s3").put_object(
+            Bucket=bucket, Key=prefix, Body=_jsonl(records)
+        )
+        job = (
+            self._session()
+            .client("bedrock")
+            .create_model_invocation_job(
+                jobName=name,
+                roleArn=self.role_arn,
+                modelId=llm.model_name,
+                inputDataConfig={
+                    "s3InputDataConfig": {"s3Uri": f"{self.input_s3_uri}/{name}.jsonl"}
+                },
+                outputDataConfig={"s3OutputDataConfig": {"s3Uri": self.output_s3_uri}},
+            )
+        )
+        return job["jobArn"]
+
+    def status(self, job_id: str) -> str:
+        job = (
+            self._session()
+            .client("bedrock")
+            .get_model_invocation_job(jobIdentifier=job_id)
+        )
+        return self._STATUS.get(job["status"], RUNNING)
+
+    def results(self, job_id: str) -> Iterator[dict]:
+        # outputs land in <output_s3_uri>/<job id>/<input file>.jsonl.out
+        s3 = self._session().client("s3")
+        bucket, prefix = self._split(f"{self.output_s3_uri}/{job_id.split('/')[-1]}/")
+        pages = s3.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
+        )
+        for page in pages:
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith(".jsonl.out"):
+                    continue
+                body = s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"]
+                for line in body.iter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class BulkJob:
+    """A submitted batch of prompts, see ``_Pr.bulk``"""
+
+    def __init__(self, prompter, backend: BulkBackend, job_id: str, inputs=None):
+        self.prompter = prompter
+        self.backend = backend
+        self.id = job_id
+        self.inputs: Dict[str, dict] = dict(inputs or {})
+
+    def status(self) -> str:
+        return self.backend.status(self.id)
+
+    def wait(self, poll_interval: float = 60, timeout: Optional[float] = None) -> str:
+        """Polls until the job completes or fails, returns the final status"""
+        start = time.monotonic()
+        while True:
+            status = self.status()
+            if status != RUNNING:
+                return status
+            if (
+                timeout is not None
+                and time.monotonic() - start + poll_interval > timeout
+            ):
+                raise TimeoutError(f"bulk job {self.id} still running after {timeout}s")
+            logger.info(
+                "Bulk job %s is running, next poll in %ss", self.id, poll_interval
+            )
+            time.sleep(poll_interval)
+
+    def results(self):
+        """Streams a BatchItem per output record through the normal
+        ``clean_result`` and ``cast_result`` path"""
+        return self.prompter._bulk_results(self)
@@ -0,0 +1,168 @@
+import abc
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic_prompter.common import Message
+
+_bypass = contextvars.ContextVar("pydantic_prompter_cache_bypass", default=False)
+
+
+def cache_key(
+    messages: List[Message],
+    scheme: Union[dict, str, None],
+    llm: str,
+    model_name: str,
+    model_settings: Optional[Dict[str, Any]],
+) -> str:
+    """Stable hash of everything that determines the provider response"""
+    payload = json.dumps(
+        {
+            "messages": [[m.role, m.content] for m in messages],
+            "scheme": scheme,
+            "llm": llm,
+            "model_name": model_name,
+            "model_settings": model_settings,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache(abc.ABC):
+    """Stores cleaned LLM responses keyed by ``cache_key``.
+
+    Only responses that were successfully cast are stored, so a bad
+    completion is never replayed. Responses are only worth caching when the
+    prompter runs with ``deterministic=True``, otherwise every call samples a
+    new temperature.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _set(self, key: str, value: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[str]:
+        if _bypass.get():
+            return None
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        if _bypass.get():
+            return
+        self._set(key, value)
+
+    @staticmethod
+    @contextmanager
+    def bypass():
+        """Skips every cache for calls made in the current thread or task"""
+        token = _bypass.set(True)
+        try:
+            yield
+        finally:
+            _bypass.reset(token)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class MemoryCache(ResponseCache):
+    """In-process LRU cache with an optional time to live in seconds"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            created, value = item
+            if self.ttl is not None and time.monotonic() - created > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache(ResponseCache):
+    """On-disk cache that survives restarts, shareable between processes"""
+
+    def __init__(
+        self, path: str = ".pydantic_prompter_cache.sqlite", ttl: Optional[float] = None
+    ):
+        import sqlite3
+
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self.ttl is not None and time.time() - created > self.ttl:
+            return None
+        return value
+
+    def _set(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Shared:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Shares one in-flight call between concurrent callers with the same key.
+
+    The first caller (the leader) runs the call, callers arriving while it
+    is in flight (followers) wait and get the leader's result or exception.
+    Threads and asyncio tasks are coalesced separately, tasks per event loop.
+    An asyncio call runs in a task of its own, a cancelled caller stops
+    waiting for it and it is only cancelled once every caller has left.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._tasks: Dict[Hashable, _Shared] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        key = (loop, key)
+        with self._lock:
+            shared = self._tasks.get(key)
+            if shared is None:
+                # a task of its own, so cancelling any one caller (the leader
+                # included) does not cancel the call for the others
+                task = loop.create_task(fn())
+                shared = self._tasks[key] = _Shared(task)
+                task.add_done_callback(lambda _: self._land(key, shared))
+                self.leaders += 1
+            else:
+                self.followers += 1
+            shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                shared.waiters -= 1
+                abandoned = shared.waiters == 0
+                if abandoned and self._tasks.get(key) is shared:
+                    del self._tasks[key]
+            if abandoned:  # nobody is left to get the result
+                shared.task.cancel()
+            raise
+
+    def _land(self, key: Hashable, shared: "_Shared"):
+        with self._lock:
+            if self._tasks.get(key) is shared:
+                del self._tasks[key]
+        if not shared.task.cancelled():
+            shared.task.exception()  # retrieved, no warning when all cancelled
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "in_flight": len(self._flights) + len(self._tasks),
+            }
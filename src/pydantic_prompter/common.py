@@ -1,28 +1,128 @@
 import logging
-from typing import Optional, List, Any, Dict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, List, Any, Dict
 
 from pydantic import BaseModel
 
-from pydantic_prompter.settings import Settings
+if TYPE_CHECKING:
+    from pydantic_prompter.settings import Settings
 
 logger = logging.getLogger("pydantic_prompter")
 logger.addHandler(logging.NullHandler())
 
-settings = Settings()
 
+@lru_cache(maxsize=None)
+def get_settings() -> "Settings":
+    """The settings snapshot shared by every provider.
 
-class Message(BaseModel):
-    role: str
-    content: str
+    Read from the environment and ``.env`` on first use rather than at
+    import, since locating ``.env`` walks the filesystem. Call
+    ``get_settings.cache_clear()`` to pick up environment changes.
+    """
+    from pydantic_prompter.settings import Settings
+
+    return Settings()
+
+
+def __getattr__(name: str):
+    # ``common.settings`` is kept for existing imports, resolved on access
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class Message:
+    """One chat turn.
+
+    A plain slotted class rather than a pydantic model: messages are built
+    per turn on every call and turned straight back into provider dicts, so
+    validation would only add overhead. ``model_dump`` is kept for code
+    written against the pydantic version.
+    """
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+
+    def model_dump(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+    def __eq__(self, other):
+        if not isinstance(other, Message):
+            return NotImplemented
+        return self.role == other.role and self.content == other.content
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content!r})"
 
     def __str__(self):
         return f"{self.role}: {self.content}"
 
 
-class LLMDataAndResult(BaseModel):
-    inputs: Dict[str, Any]
-    messages: Optional[List[Message]] = None
-    raw_result: Optional[str] = None
-    clean_result: Optional[str] = None
-    result: Optional[BaseModel] = None
-    error: Optional[Any] = None
+class LLMDataAndResult:
+    """Everything known about one call attempt, handed to ``log_hook`` and
+    instruments. Slotted for the same reason as ``Message``."""
+
+    __slots__ = (
+        "inputs",
+        "messages",
+        "raw_result",
+        "clean_result",
+        "result",
+        "error",
+        "cached",
+        "coalesced",
+        "retries",
+        "repairs",
+        "timings",
+        "usage",
+    )
+
+    def __init__(
+        self,
+        inputs: Dict[str, Any],
+        messages: Optional[List[Message]] = None,
+        raw_result: Optional[str] = None,
+        clean_result: Optional[str] = None,
+        result: Optional[Any] = None,
+        error: Optional[Any] = None,
+        cached: bool = False,
+        coalesced: bool = False,
+        retries: int = 0,
+        repairs: int = 0,
+        timings: Optional[Dict[str, float]] = None,
+        usage: Optional[Dict[str, int]] = None,
+    ):
+        self.inputs = inputs
+        self.messages = messages
+        self.raw_result = raw_result
+        self.clean_result = clean_result
+        self.result = result
+        self.error = error
+        self.cached = cached
+        self.coalesced = coalesced
+        self.retries = retries
+        self.repairs = repairs
+        self.timings = {} if timings is None else timings
+        self.usage = {} if usage is None else usage
+
+    def model_dump(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        if self.messages is not None:
+            data["messages"] = [m.model_dump() for m in self.messages]
+        if isinstance(self.result, BaseModel):
+            data["result"] = self.result.model_dump()
+        return data
+
+    def __eq__(self, other):
+        if not isinstance(other, LLMDataAndResult):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"LLMDataAndResult({fields})"
@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class NonRetryable(Exception):
     pass
 
@@ -6,6 +9,27 @@ class Retryable(Exception):
     pass
 
 
+class ProviderUnavailableError(Retryable):
+    """Transient provider failure such as a network error, timeout or 5xx"""
+
+    def __init__(self, *args, retry_after: Optional[float] = None):
+        super().__init__(*args)
+        self.retry_after = retry_after
+
+
+class ProviderThrottlingError(ProviderUnavailableError):
+    """The provider rejected the request because of rate limits"""
+
+
+class DeadlineExceededError(NonRetryable):
+    pass
+
+
+class PromptTooLongError(NonRetryable):
+    """The estimated prompt leaves no room for the response in the context
+    window, raised before anything is sent"""
+
+
 class OpenAiAuthenticationError(NonRetryable):
     pass
 
@@ -32,3 +56,11 @@ class CohereAuthenticationError(NonRetryable):
 
 class ArgumentError(NonRetryable):
     pass
+
+
+class MockProviderError(NonRetryable):
+    pass
+
+
+class BulkRecordError(NonRetryable):
+    """The provider reported an error for one record of a bulk job"""
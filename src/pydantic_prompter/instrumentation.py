@@ -0,0 +1,134 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional
+
+from pydantic_prompter.common import LLMDataAndResult, logger
+
+_current: contextvars.ContextVar[Optional["Recorder"]] = contextvars.ContextVar(
+    "pydantic_prompter_recorder", default=None
+)
+
+
+class Stage(NamedTuple):
+    name: str
+    start_ns: int  # wall clock, nanoseconds since the epoch
+    end_ns: int
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+
+class Instrument:
+    """Receives the stages of every prompt call attempt.
+
+    ``llm_data.timings`` holds the seconds spent per stage (``render``,
+    ``queue``, ``request``, ``decode``, ``clean``, ``cast`` and ``repair``,
+    where ``queue`` is the wait for a rate limiter and ``decode`` is part of
+    ``request``), ``llm_data.usage`` the provider-reported token counts,
+    ``llm_data.retries`` the number of earlier attempts and
+    ``llm_data.repairs`` the number of repair turns.
+    """
+
+    def on_call(self, llm_data: LLMDataAndResult, stages: List[Stage]):
+        raise NotImplementedError
+
+
+class OpenTelemetryInstrument(Instrument):
+    """Emits a ``pydantic_prompter.call`` span with a child span per stage.
+
+    Requires the ``opentelemetry-api`` package.
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("pydantic_prompter")
+
+    def on_call(self, llm_data: LLMDataAndResult, stages: List[Stage]):
+        if not stages:
+            return
+        call = self.tracer.start_span(
+            "pydantic_prompter.call", start_time=stages[0].start_ns
+        )
+        call.set_attribute("pydantic_prompter.retries", llm_data.retries)
+        call.set_attribute("pydantic_prompter.cached", llm_data.cached)
+        for name, count in llm_data.usage.items():
+            call.set_attribute(f"pydantic_prompter.usage.{name}", count)
+        if llm_data.error is not None:
+            call.set_attribute("error.type", type(llm_data.error).__name__)
+
+        context = self._trace.set_span_in_context(call)
+        for stage in stages:
+            span = self.tracer.start_span(
+                f"pydantic_prompter.{stage.name}",
+                context=context,
+                start_time=stage.start_ns,
+            )
+            span.end(end_time=stage.end_ns)
+        call.end(end_time=max(stage.end_ns for stage in stages))
+
+
+class Recorder:
+    def __init__(self, llm_data: LLMDataAndResult):
+        self.llm_data = llm_data
+        self.stages: List[Stage] = []
+
+    @contextmanager
+    def active(self) -> Iterator["Recorder"]:
+        """Makes this recorder the target of ``stage`` and ``record_usage``"""
+        token = _current.set(self)
+        try:
+            yield self
+        except BaseException as e:
+            if self.llm_data.error is None:
+                self.llm_data.error = e
+            raise
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start_ns = time.time_ns()
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self.stages.append(Stage(name, start_ns, start_ns + elapsed))
+            timings = self.llm_data.timings
+            timings[name] = timings.get(name, 0.0) + elapsed / 1e9
+
+    def add_usage(self, **counts: Optional[int]):
+        usage = self.llm_data.usage
+        for name, count in counts.items():
+            if count is not None:
+                usage[name] = usage.get(name, 0) + int(count)
+
+    def finish(self, instrument: Optional[Instrument]):
+        if instrument is None:
+            return
+        try:
+            instrument.on_call(self.llm_data, self.stages)
+        except Exception:
+            logger.exception("instrument failed")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times a stage of the call that is currently being recorded, if any"""
+    recorder = _current.get()
+    if recorder is None:
+        yield
+        return
+    with recorder.stage(name):
+        yield
+
+
+def record_usage(**counts: Optional[int]):
+    """Adds provider reported token counts to the current call, if any"""
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.add_usage(**counts)
@@ -1,35 +1,91 @@
-from typing import Type, Dict, Union
+import importlib
+from typing import Any, Dict, Type, Union
+
 from pydantic_prompter.annotation_parser import AnnotationParser
 from pydantic_prompter.common import logger
-from pydantic_prompter.llm_providers.bedrock_anthropic import BedRockAnthropic
-from pydantic_prompter.llm_providers.bedrock_cohere import BedRockCohere
-from pydantic_prompter.llm_providers.bedrock_llama2 import BedRockLlama2
-from pydantic_prompter.llm_providers.cohere import Cohere
-from pydantic_prompter.llm_providers.openai import OpenAI
 from pydantic_prompter.llm_providers.base import LLM
 
-# Mapping of llm type and model_name prefixes to their respective classes
-LLM_MODEL_MAP: Dict[str, Dict[str, Type[LLM]]] = {
+ENTRY_POINT_GROUP = "pydantic_prompter.providers"
+
+# Mapping of llm type and model_name prefixes to their respective classes.
+# Providers are "module:Class" paths imported on first use, so importing the
+# package does not pull in every provider and its client libraries.
+LLM_MODEL_MAP: Dict[str, Dict[str, Any]] = {
     "openai": {
-        "default": OpenAI,
+        "default": "pydantic_prompter.llm_providers.openai:OpenAI",
     },
     "bedrock": {
-        "anthropic": BedRockAnthropic,
-        "cohere": BedRockCohere,
-        "meta": BedRockLlama2,
+        "anthropic": "pydantic_prompter.llm_providers.bedrock_anthropic:BedRockAnthropic",
+        "cohere": "pydantic_prompter.llm_providers.bedrock_cohere:BedRockCohere",
+        "meta": "pydantic_prompter.llm_providers.bedrock_llama2:BedRockLlama2",
     },
     "cohere": {
-        "command": Cohere,
+        "default": "pydantic_prompter.llm_providers.cohere:Cohere",
+    },
+    "mock": {
+        "default": "pydantic_prompter.llm_providers.mock:Mock",
+    },
+    "replay": {
+        "default": "pydantic_prompter.llm_providers.mock:Replay",
     },
 }
 
+_entry_points_loaded = False
+
+
+def register_provider(
+    llm: str, provider: Union[Type[LLM], str], prefix: str = "default"
+):
+    """Adds a provider for ``llm`` and model names starting with ``prefix.``
+
+    ``provider`` is an LLM subclass or a ``"module:Class"`` path imported on
+    first use. Installed packages can register providers without being
+    imported, through a ``pydantic_prompter.providers`` entry point named
+    ``llm`` or ``llm.prefix``::
+
+        [project.entry-points."pydantic_prompter.providers"]
+        "bedrock.mistral" = "my_package.mistral:BedRockMistral"
+    """
+    LLM_MODEL_MAP.setdefault(llm, {})[prefix] = provider
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    from importlib.metadata import entry_points
+
+    found = entry_points()
+    if hasattr(found, "select"):
+        found = found.select(group=ENTRY_POINT_GROUP)
+    else:  # python < 3.10
+        found = found.get(ENTRY_POINT_GROUP, [])
+    for entry_point in found:
+        llm, _, prefix = entry_point.name.partition(".")
+        # explicitly registered and built-in providers take precedence
+        LLM_MODEL_MAP.setdefault(llm, {}).setdefault(prefix or "default", entry_point)
+    _entry_points_loaded = True
+
+
+def _resolve(models: Dict[str, Any], key: str) -> Type[LLM]:
+    provider = models[key]
+    if isinstance(provider, str):
+        module, _, name = provider.partition(":")
+        provider = getattr(importlib.import_module(module), name)
+    elif not isinstance(provider, type):  # entry point
+        provider = provider.load()
+    models[key] = provider
+    return provider
+
 
 def get_llm(
     llm: str,
     model_name: str,
     parser: AnnotationParser,
     model_settings: Union[dict, None] = None,
+    deterministic: bool = False,
 ) -> LLM:
+    _load_entry_points()
     if llm not in LLM_MODEL_MAP:
         raise ValueError(f"LLM type '{llm}' is not implemented")
 
@@ -38,13 +94,34 @@ def get_llm(
         0
     ]  # Extract 'anthropic' from 'anthropic.claude-3-sonnet-20240229-v1:0'
 
-    model_class = LLM_MODEL_MAP.get(llm, {}).get(model_prefix, None)
+    models = LLM_MODEL_MAP.get(llm, {})
+    key = model_prefix if model_prefix in models else "default"
 
-    if model_class is None:
+    if key not in models:
         raise ValueError(
             f"Model prefix '{model_prefix}' for LLM type '{llm}' is not implemented"
         )
+    model_class = _resolve(models, key)
+
+    logger.debug("Using %s provider with model %s", model_class.__name__, model_name)
+
+    return model_class(model_name, parser, model_settings, deterministic=deterministic)
+
+
+_EXPORTS = {
+    "BedRockAnthropic": "bedrock_anthropic",
+    "BedRockCohere": "bedrock_cohere",
+    "BedRockLlama2": "bedrock_llama2",
+    "Cohere": "cohere",
+    "Mock": "mock",
+    "Replay": "mock",
+    "OpenAI": "openai",
+}
 
-    logger.debug(f"Using {model_class.__name__} provider with model {model_name}")
 
-    return model_class(model_name, parser, model_settings)
+def __getattr__(name: str):
+    # provider classes stay importable from here, without the eager import
+    if name in _EXPORTS:
+        module = importlib.import_module(f"{__name__}.{_EXPORTS[name]}")
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
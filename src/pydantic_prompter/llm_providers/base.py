@@ -1,24 +1,132 @@
-from typing import List, Union
+import asyncio
+import json
+import random
+from typing import List, Union, Optional, Dict, Iterator, AsyncIterator, Tuple
 
 from pydantic_prompter.annotation_parser import AnnotationParser
-from pydantic_prompter.common import Message
+from pydantic_prompter.common import Message, get_settings, logger
+from pydantic_prompter.exceptions import PromptTooLongError
+from pydantic_prompter.instrumentation import record_usage
+from pydantic_prompter.tokens import (
+    INSTRUCTION_TOKENS,
+    MIN_OUTPUT_TOKENS,
+    TokenEstimator,
+    context_window,
+    output_budget,
+)
 
 
 class LLM:
+    estimator = TokenEstimator()
+    # the largest output the provider's models allow, None when a request
+    # may leave max_tokens out and the model's own maximum applies
+    max_output_cap: Optional[int] = None
+    batch_api = False  # implements batch_record and batch_output
+
     @staticmethod
     def clean_result(body: str):
         return body
 
-    def __init__(self, model_name: str, parser: AnnotationParser):
-        from pydantic_prompter.settings import Settings
-
+    def __init__(
+        self,
+        model_name: str,
+        parser: AnnotationParser,
+        model_settings: Optional[Dict] = None,
+        deterministic: bool = False,
+    ):
         self.parser: AnnotationParser = parser
-        self.settings = Settings()
+        self._settings = None
         self.model_name = model_name
+        self.model_settings = model_settings
+        self.deterministic = deterministic
+        self.context_window = context_window(model_name)
+        self._budget: Optional[Tuple[Optional[int]]] = None  # (budget,) once sized
+
+    @property
+    def settings(self):
+        # resolved on first use, so decorating a function reads no configuration
+        if self._settings is None:
+            self._settings = get_settings()
+        return self._settings
+
+    @settings.setter
+    def settings(self, value):
+        self._settings = value
+
+    def _temperature(self, low: float, high: float) -> float:
+        # a random temperature per call spreads retries over different
+        # completions, deterministic mode pins it so responses are repeatable
+        if self.deterministic:
+            return 0.0
+        return random.uniform(low, high)
+
+    def _schema_json(self, scheme: dict) -> str:
+        # the parser's own schema is serialized once and shared by every call
+        if scheme is self.parser.llm_schema():
+            return self.parser.llm_schema_json()
+        return json.dumps(scheme, indent=4)
 
     def debug_prompt(self, messages: List[Message], scheme: Union[dict, str]):
         raise NotImplementedError
 
+    def _output_budget(self, scheme: Union[dict, None], return_type) -> Optional[int]:
+        # the parser's own schema gives the same budget on every call
+        if scheme is not None and scheme is self.parser.llm_schema():
+            if self._budget is None:
+                self._budget = (
+                    output_budget(self.estimator, scheme, None, self.max_output_cap),
+                )
+            return self._budget[0]
+        return output_budget(self.estimator, scheme, return_type, self.max_output_cap)
+
+    def preflight(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> Optional[int]:
+        """Estimates the prompt and returns the ``max_tokens`` to request.
+
+        The budget comes from the return schema and is trimmed to what is
+        left of the context window, None means no limit is sent. Raises PromptTooLongError, without
+        calling the provider, when less than ``MIN_OUTPUT_TOKENS`` is left.
+        The estimate and budget are recorded in the call's usage as
+        ``estimated_input_tokens`` and ``output_budget_tokens``.
+        """
+        spec = self._schema_json(scheme) if scheme else return_type or ""
+        prompt = (
+            self.estimator.messages(messages)
+            + self.estimator.count(spec)
+            + INSTRUCTION_TOKENS
+        )
+        budget = self._output_budget(scheme, return_type)
+        if self.context_window is not None:
+            room = self.context_window - prompt
+            if room < MIN_OUTPUT_TOKENS:
+                raise PromptTooLongError(
+                    f"about {prompt} prompt tokens, {self.model_name} "
+                    f"takes {self.context_window}"
+                )
+            if budget is not None and room < budget:
+                logger.info("Output budget trimmed from %s to %s", budget, room)
+                budget = room
+        record_usage(estimated_input_tokens=prompt, output_budget_tokens=budget)
+        return budget
+
+    def batch_record(
+        self,
+        custom_id: str,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> dict:
+        """One line of the provider's batch inference input file"""
+        raise NotImplementedError(f"{type(self).__name__} has no batch API")
+
+    def batch_output(self, record: dict) -> Tuple[str, Optional[str], Optional[str]]:
+        """``(custom_id, text, error)`` from one line of a batch output file"""
+        raise NotImplementedError(f"{type(self).__name__} has no batch API")
+
     def call(
         self,
         messages: List[Message],
@@ -26,3 +134,32 @@ class LLM:
         return_type: Union[str, None] = None,
     ) -> str:
         raise NotImplementedError
+
+    async def acall(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        # providers without a native async client run the blocking call
+        # on the default executor so the event loop is never blocked
+        return await asyncio.to_thread(
+            self.call, messages, scheme=scheme, return_type=return_type
+        )
+
+    def stream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> Iterator[str]:
+        # providers without streaming support deliver the reply in one chunk
+        yield self.call(messages, scheme=scheme, return_type=return_type)
+
+    async def astream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> AsyncIterator[str]:
+        yield await self.acall(messages, scheme=scheme, return_type=return_type)
@@ -1,11 +1,20 @@
-import json
-import random
 from typing import List, Optional, Dict, Union
-from fix_busted_json import repair_json, largest_json
+from pydantic_prompter import serializer
 from pydantic_prompter.common import Message, logger
+from pydantic_prompter.instrumentation import stage
 from pydantic_prompter.llm_providers.bedrock_base import BedRock
 from pydantic_prompter.annotation_parser import AnnotationParser
 
+# Claude models Bedrock accepts cache_control for, it rejects the field for
+# the others (e.g. anthropic.claude-3-sonnet-20240229-v1:0)
+PROMPT_CACHE_MODELS = (
+    "claude-3-7-sonnet",
+    "claude-3-5-haiku",
+    "claude-sonnet-4",
+    "claude-opus-4",
+    "claude-haiku-4",
+)
+
 
 class BedRockAnthropic(BedRock):
     def __init__(
@@ -13,11 +22,11 @@ class BedRockAnthropic(BedRock):
         model_name: str,
         parser: AnnotationParser,
         model_settings: Optional[Dict] = None,
+        deterministic: bool = False,
     ):
-        super().__init__(model_name, parser)
+        super().__init__(model_name, parser, deterministic=deterministic)
         self.model_settings = model_settings or {
-            "temperature": random.uniform(0, 1),
-            "max_tokens": 8000,
+            "temperature": self._temperature(0, 1),
             "stop_sequences": ["Human:"],
             "anthropic_version": "bedrock-2023-05-31",
         }
@@ -52,13 +61,12 @@ class BedRockAnthropic(BedRock):
                 fixed_messages.append(m)
         return fixed_messages
 
-    def call(
+    def _body(
         self,
         messages: List[Message],
         scheme: Union[dict, None] = None,
         return_type: Union[str, None] = None,
-    ) -> str:
-
+    ) -> dict:
         if scheme:
             system_message = f"""Act like a REST API that performs the requested operation the user asked according to guidelines provided.
                     Your response should be a valid JSON format, strictly adhering to the Pydantic schema provided in the pydantic_schema section. 
@@ -68,7 +76,7 @@ class BedRockAnthropic(BedRock):
 
                     ## pydantic_schema:
 
-                    {json.dumps(scheme, indent=4)}
+                    {self._schema_json(scheme)}
                     
                     """
         else:  # return_type:
@@ -84,13 +92,14 @@ class BedRockAnthropic(BedRock):
                     
 """
 
-        final_messages = [m.model_dump() for m in messages]
+        final_messages = [{"role": m.role, "content": m.content} for m in messages]
         final_messages = self.fix_messages(final_messages)
 
         # Ensure stop_sequences and anthropic_version are always included
         body = {
-            "system": system_message,
+            "system": self._system(system_message),
             "messages": final_messages,
+            "max_tokens": self.preflight(messages, scheme, return_type),
             "stop_sequences": self.model_settings.get(
                 "stop_sequences", [self._stop_sequence]
             ),
@@ -99,11 +108,44 @@ class BedRockAnthropic(BedRock):
             ),
             **self.model_settings,
         }
+        return body
+
+    def _system(self, system_message: str) -> Union[str, List[dict]]:
+        # the instructions and schema are the same on every call of a function,
+        # a cache breakpoint after them lets Bedrock reuse the processed prefix
+        if not self.settings.prompt_cache or not any(
+            model in self.model_name for model in PROMPT_CACHE_MODELS
+        ):
+            return system_message
+        return [
+            {
+                "type": "text",
+                "text": system_message,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
 
-        response = self._boto_invoke(json.dumps(body))
-        response_text = response.get("body").read().decode()
-        response_json = repair_json(largest_json(response_text))
-        response_body = json.loads(response_json)
+    @staticmethod
+    def _stream_text(chunk: dict) -> str:
+        if chunk.get("type") == "content_block_delta":
+            return chunk["delta"].get("text", "")
+        return ""
 
-        logger.info(response_body)
+    @staticmethod
+    def _response_text(response_body: dict) -> str:
         return response_body.get("content")[0]["text"]
+
+    def call(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        body = self._body(messages, scheme, return_type)
+
+        response = self._boto_invoke(serializer.dumps(body))
+        with stage("decode"):
+            response_body = self.decode_envelope(response.get("body").read())
+
+        logger.debug("Response body: \n%s", response_body)
+        return self._response_text(response_body)
@@ -1,33 +1,70 @@
 import abc
+import asyncio
+import contextvars
 import json
-import random
-from typing import List, Union
-from jinja2 import Template
-from fix_busted_json import repair_json
+import re
+import threading
+from json import JSONDecodeError
+from typing import AsyncIterator, List, Optional, Union, Iterator, Tuple
+from pydantic_prompter import serializer
+from fix_busted_json import largest_json, repair_json
 from pydantic_prompter.common import Message, logger
-from pydantic_prompter.exceptions import BedRockAuthenticationError
+from pydantic_prompter.exceptions import (
+    BedRockAuthenticationError,
+    ProviderThrottlingError,
+    ProviderUnavailableError,
+)
+from pydantic_prompter.instrumentation import record_usage, stage
 from pydantic_prompter.llm_providers.base import LLM
+from pydantic_prompter.llm_providers.clients import client_registry
+from pydantic_prompter.templates import file_template
+from pydantic_prompter.tokens import TokenEstimator
+
+MAX_POOL_CONNECTIONS = 50  # allow for significant concurrency
+
+# tag wrappers the prompt templates ask the model to put around its answer
+_WRAPPERS = re.compile(r"</?(?:json|str|int|bool)>|```")
+
+THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException"}
+UNAVAILABLE_CODES = {
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+}
 
 
 class BedRock(LLM, abc.ABC):
+    estimator = TokenEstimator(chars_per_token=3.5, per_message=3)
+    max_output_cap = 8000
+    batch_api = True
+
     @staticmethod
     def clean_result(body: str):
-        body = body.split("<json_schema>")[0]
-        body = body.replace("</json>", "")
-        body = body.replace("</str>", "")
-        body = body.replace("</int>", "")
-        body = body.replace("</bool>", "")
-        body = body.replace("<json>", "")
-        body = body.replace("<str>", "")
-        body = body.replace("<int>", "")
-        body = body.replace("<bool>", "")
-        body = body.replace("```", "")
-        if "{" in body and "}" in body:
-            left = body.find("{")
-            right = body.rfind("}")
+        end = body.find("<json_schema>")  # the model echoing the prompt
+        if end != -1:
+            body = body[:end]
+        # tags never contain braces, so slice out the outermost object first,
+        # wrappers are then usually gone and the (memchr fast) checks skip
+        # the regex pass over large outputs
+        left = body.find("{")
+        right = body.rfind("}")
+        if left != -1 and right != -1:
             body = body[left : right + 1]  # noqa
+        if "<" in body or "`" in body:
+            body = _WRAPPERS.sub("", body)
         return body
 
+    @staticmethod
+    def decode_envelope(data: Union[str, bytes]) -> dict:
+        """Parses the response envelope, repaired only if it is not valid JSON"""
+        try:
+            return serializer.loads(data)
+        except JSONDecodeError:
+            if isinstance(data, bytes):
+                data = data.decode()
+            return json.loads(repair_json(largest_json(data)))
+
     @property
     @abc.abstractmethod
     def _template_path(self) -> str:
@@ -44,26 +81,24 @@ class BedRock(LLM, abc.ABC):
 
     def _build_prompt(self, messages: List[Message], params: Union[dict, str]):
         if "prompt_templates" not in self._template_path:
-            logger.info(f"Using custom prompt from {self._template_path}")
-        ant_template = open(self._template_path).read()
+            logger.info("Using custom prompt from %s", self._template_path)
         if isinstance(params, dict):
-            scheme_ = json.dumps(params, indent=4)
+            scheme_ = self._schema_json(params)
         else:
             scheme_ = params
         ant_msgs = self.format_messages(messages)
-        template = Template(ant_template, keep_trailing_newline=True)
+        template = file_template(self._template_path)
         content = template.render(schema=scheme_, question=ant_msgs).strip()
         return content
 
     def debug_prompt(self, messages: List[Message], scheme: Union[dict, str]) -> str:
         return self._build_prompt(messages, scheme)
 
-    def _boto_invoke(self, body):
-        try:
-            logger.debug(f"Request body: \n{body}")
-            import boto3
-            from botocore.config import Config
+    def _client(self):
+        import boto3
+        from botocore.config import Config
 
+        def create():
             session = boto3.Session(
                 aws_access_key_id=self.settings.aws_access_key_id,
                 aws_secret_access_key=self.settings.aws_secret_access_key,
@@ -77,9 +112,47 @@ class BedRock(LLM, abc.ABC):
                     "max_attempts": 5,
                     "mode": "adaptive",
                 },  # retry 5 times adaptivly
-                max_pool_connections=50,  # allow for significant concurrency
+                max_pool_connections=MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
             )
-            client = session.client("bedrock-runtime", config=config)
+            return session.client("bedrock-runtime", config=config)
+
+        return client_registry.get(
+            "bedrock",
+            (
+                self.settings.aws_access_key_id,
+                self.settings.aws_secret_access_key,
+                self.settings.aws_session_token,
+                self.settings.aws_profile,
+                self.settings.aws_default_region,
+            ),
+            create,
+            label=self.settings.aws_default_region,
+            max_connections=MAX_POOL_CONNECTIONS,
+        )
+
+    @staticmethod
+    def _error(e: Exception) -> Exception:
+        """Maps a botocore error to a retryable or a terminal exception"""
+        from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+        from pydantic_prompter.retries import parse_retry_after
+
+        if isinstance(e, (ConnectionError, HTTPClientError)):
+            return ProviderUnavailableError(e)
+        if isinstance(e, ClientError):
+            code = e.response.get("Error", {}).get("Code")
+            headers = e.response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+            retry_after = parse_retry_after(headers.get("retry-after"))
+            if code in THROTTLING_CODES:
+                return ProviderThrottlingError(e, retry_after=retry_after)
+            if code in UNAVAILABLE_CODES:
+                return ProviderUnavailableError(e, retry_after=retry_after)
+        return BedRockAuthenticationError(e)
+
+    def _boto_invoke(self, body):
+        try:
+            logger.debug("Request body: \n%s", body)
+            client = self._client()
             # execute the model
             response = client.invoke_model(
                 body=body,
@@ -88,30 +161,147 @@ class BedRock(LLM, abc.ABC):
                 contentType="application/json",
             )
         except Exception as e:
-            raise BedRockAuthenticationError(e)
+            raise self._error(e)
 
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        record_usage(
+            input_tokens=headers.get("x-amzn-bedrock-input-token-count"),
+            output_tokens=headers.get("x-amzn-bedrock-output-token-count"),
+            cache_read_input_tokens=headers.get(
+                "x-amzn-bedrock-cache-read-input-token-count"
+            ),
+            cache_write_input_tokens=headers.get(
+                "x-amzn-bedrock-cache-write-input-token-count"
+            ),
+        )
         return response
 
-    def call(
+    def _boto_invoke_stream(self, body):
+        try:
+            logger.debug("Request body: \n%s", body)
+            response = self._client().invoke_model_with_response_stream(
+                body=body,
+                modelId=self.model_name,
+                accept="application/json",
+                contentType="application/json",
+            )
+        except Exception as e:
+            raise self._error(e)
+
+        return response
+
+    def _body(
         self,
         messages: List[Message],
         scheme: Union[dict, None] = None,
         return_type: Union[str, None] = None,
-    ) -> str:
+    ) -> dict:
         content = self._build_prompt(messages, scheme or return_type)
+        return {
+            "max_tokens_to_sample": self.preflight(messages, scheme, return_type),
+            "prompt": content,
+            "stop_sequences": [self._stop_sequence],
+            "temperature": self._temperature(0, 1),
+        }
 
-        body = json.dumps(
-            {
-                "max_tokens_to_sample": 8000,
-                "prompt": content,
-                "stop_sequences": [self._stop_sequence],
-                "temperature": random.uniform(0, 1),
-            }
-        )
+    @staticmethod
+    def _stream_text(chunk: dict) -> str:
+        return chunk.get("completion", "")
 
-        response = self._boto_invoke(body)
-        response_text = response.get("body").read().decode()
-        response_json = repair_json(response_text)
-        response_body = json.loads(response_json)
-        logger.info(response_body)
+    @staticmethod
+    def _response_text(response_body: dict) -> str:
         return response_body.get("completion")
+
+    def batch_record(
+        self,
+        custom_id: str,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> dict:
+        return {
+            "recordId": custom_id,
+            "modelInput": self._body(messages, scheme, return_type),
+        }
+
+    def batch_output(self, record: dict) -> Tuple[str, Optional[str], Optional[str]]:
+        if record.get("error") or "modelOutput" not in record:
+            return record["recordId"], None, str(record.get("error"))
+        return record["recordId"], self._response_text(record["modelOutput"]), None
+
+    def call(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        body = serializer.dumps(self._body(messages, scheme, return_type))
+
+        response = self._boto_invoke(body)
+        with stage("decode"):
+            response_body = self.decode_envelope(response.get("body").read())
+        logger.debug("Response body: \n%s", response_body)
+        return self._response_text(response_body)
+
+    def stream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> Iterator[str]:
+        body = serializer.dumps(self._body(messages, scheme, return_type))
+
+        events = self._boto_invoke_stream(body).get("body")
+        try:
+            for event in events:
+                chunk = event.get("chunk")
+                if chunk:
+                    yield self._stream_text(serializer.loads(chunk["bytes"]))
+        finally:
+            # stop generating (and billing) when the caller stops reading
+            events.close()
+
+    async def astream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> AsyncIterator[str]:
+        # boto3 has no async client, so the response stream is read on a
+        # worker thread and handed over chunk by chunk
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # the loop is gone, nobody is reading
+                stop.set()
+
+        def pump():
+            chunks = self.stream(messages, scheme, return_type)
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        break
+                    put((chunk, None))
+            except Exception as e:
+                put((done, e))
+                return
+            finally:
+                chunks.close()  # stops generating when the reader stopped
+            put((done, None))
+
+        loop.run_in_executor(None, contextvars.copy_context().run, pump)
+        try:
+            while True:
+                chunk, error = await queue.get()
+                if error is not None:
+                    raise error
+                if chunk is done:
+                    return
+                yield chunk
+        finally:
+            stop.set()
@@ -1,12 +1,16 @@
-import json
-import random
 from typing import List, Union
+from pydantic_prompter import serializer
 
 from pydantic_prompter.common import Message, logger
+from pydantic_prompter.instrumentation import stage
 from pydantic_prompter.llm_providers.bedrock_base import BedRock
+from pydantic_prompter.tokens import TokenEstimator
 
 
 class BedRockCohere(BedRock):
+    estimator = TokenEstimator(chars_per_token=4.0, per_message=3)
+    max_output_cap = 4000
+
     @property
     def _template_path(self) -> str:
         path = self.settings.template_paths.cohere.replace(
@@ -25,24 +29,41 @@ class BedRockCohere(BedRock):
             output.append(f"{role_converter[msg.role]}: {msg.content}")
         return "\n".join(output)
 
-    def call(
+    def _body(
         self,
         messages: List[Message],
         scheme: Union[dict, None] = None,
         return_type: Union[str, None] = None,
-    ) -> str:
+    ) -> dict:
         content = self._build_prompt(messages, scheme or return_type)
+        return {
+            "prompt": content,
+            "max_tokens": self.preflight(messages, scheme, return_type),
+            "stop_sequences": [self._stop_sequence],
+            "temperature": self._temperature(0, 1),
+        }
 
-        body = json.dumps(
-            {
-                "prompt": content,
-                "stop_sequences": [self._stop_sequence],
-                "temperature": random.uniform(0, 1),
-            }
-        )
+    @staticmethod
+    def _stream_text(chunk: dict) -> str:
+        if "generations" in chunk:
+            return chunk["generations"][0].get("text", "")
+        return chunk.get("text", "")
+
+    @staticmethod
+    def _response_text(response_body: dict) -> str:
+        return response_body["generations"][0]["text"]
+
+    def call(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        body = serializer.dumps(self._body(messages, scheme, return_type))
         response = self._boto_invoke(body)
 
-        response_body = json.loads(response.get("body").read().decode())
-        logger.info(response_body)
+        with stage("decode"):
+            response_body = self.decode_envelope(response.get("body").read())
+        logger.debug("Response body: \n%s", response_body)
 
-        return response_body["generations"][0]["text"]
+        return self._response_text(response_body)
@@ -1,12 +1,15 @@
-import json
-import random
 from typing import List, Union
+from pydantic_prompter import serializer
 
 from pydantic_prompter.common import Message, logger
+from pydantic_prompter.instrumentation import stage
 from pydantic_prompter.llm_providers.bedrock_base import BedRock
+from pydantic_prompter.tokens import TokenEstimator
 
 
 class BedRockLlama2(BedRock):
+    estimator = TokenEstimator(chars_per_token=3.2, per_message=4)
+    max_output_cap = 2048
 
     @property
     def _template_path(self) -> str:
@@ -30,22 +33,36 @@ class BedRockLlama2(BedRock):
                 output.append(f"[INST] {msg.content} [/INST]")
         return "\n".join(output)
 
-    def call(
+    def _body(
         self,
         messages: List[Message],
         scheme: Union[dict, None] = None,
         return_type: Union[str, None] = None,
-    ) -> str:
+    ) -> dict:
         content = self._build_prompt(messages, scheme or return_type)
+        return {
+            "max_gen_len": self.preflight(messages, scheme, return_type),
+            "prompt": content,
+            "temperature": self._temperature(0, 1),
+        }
 
-        body = json.dumps(
-            {
-                "max_gen_len": 2048,
-                "prompt": content,
-                "temperature": random.uniform(0, 1),
-            }
-        )
-        response = self._boto_invoke(body)
-        response_body = json.loads(response.get("body").read().decode())
-        logger.debug(response_body)
+    @staticmethod
+    def _stream_text(chunk: dict) -> str:
+        return chunk.get("generation", "")
+
+    @staticmethod
+    def _response_text(response_body: dict) -> str:
         return response_body.get("generation")
+
+    def call(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        body = serializer.dumps(self._body(messages, scheme, return_type))
+        response = self._boto_invoke(body)
+        with stage("decode"):
+            response_body = self.decode_envelope(response.get("body").read())
+        logger.debug("Response body: \n%s", response_body)
+        return self._response_text(response_body)
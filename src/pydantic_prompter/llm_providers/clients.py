@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class _Entry:
+    __slots__ = ("provider", "label", "client", "max_connections", "reused")
+
+    def __init__(self, provider: str, label: str, client: Any, max_connections):
+        self.provider = provider
+        self.label = label
+        self.client = client
+        self.max_connections = max_connections
+        self.reused = 0
+
+
+class ClientRegistry:
+    """Process wide cache of provider SDK clients.
+
+    SDK clients own the HTTP connection pool, so keeping one client per
+    provider, credentials and region lets steady-state calls reuse warm
+    keep-alive connections instead of resolving credentials and doing a TLS
+    handshake per prompt.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[Hashable, ...], _Entry] = {}
+        # loop -> entries, weak so a finished asyncio.run does not pin its loop
+        self._loop_entries: "weakref.WeakKeyDictionary[Any, Dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def get(
+        self,
+        provider: str,
+        key: Tuple[Hashable, ...],
+        factory: Callable[[], Any],
+        label: str = "",
+        max_connections: Optional[int] = None,
+    ) -> Any:
+        full_key = (provider,) + tuple(key)
+        entry = self._entries.get(full_key)
+        if entry is not None:
+            entry.reused += 1
+            return entry.client
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                entry.reused += 1
+                return entry.client
+            entry = _Entry(provider, label, factory(), max_connections)
+            self._entries[full_key] = entry
+            return entry.client
+
+    def get_async(
+        self,
+        provider: str,
+        key: Tuple[Hashable, ...],
+        factory: Callable[[], Any],
+        label: str = "",
+        max_connections: Optional[int] = None,
+    ) -> Any:
+        """``get`` for async clients, whose pools are bound to the running loop.
+
+        Clients are cached per event loop and dropped once their loop is
+        closed or garbage collected, so every ``asyncio.run`` does not leave
+        a client and its connection pool behind.
+        """
+        loop = asyncio.get_running_loop()
+        full_key = (provider,) + tuple(key)
+        with self._lock:
+            for closed in [other for other in self._loop_entries if other.is_closed()]:
+                del self._loop_entries[closed]
+            entries = self._loop_entries.setdefault(loop, {})
+            entry = entries.get(full_key)
+            if entry is not None:
+                entry.reused += 1
+                return entry.client
+            entry = _Entry(provider, label, factory(), max_connections)
+            entries[full_key] = entry
+            return entry.client
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Pool statistics per cached client, credentials are never included"""
+        with self._lock:
+            entries = list(self._entries.values())
+            for loop, per_loop in list(self._loop_entries.items()):
+                if not loop.is_closed():
+                    entries.extend(per_loop.values())
+            return [
+                {
+                    "provider": e.provider,
+                    "label": e.label,
+                    "reused": e.reused,
+                    "max_connections": e.max_connections,
+                }
+                for e in entries
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loop_entries.clear()
+
+
+client_registry = ClientRegistry()
@@ -1,19 +1,76 @@
-import random
-from typing import List, Union
+from typing import List, Union, Iterator, AsyncIterator
 
 from pydantic_prompter.common import Message, logger
-from pydantic_prompter.exceptions import CohereAuthenticationError
+from pydantic_prompter.exceptions import (
+    CohereAuthenticationError,
+    ProviderThrottlingError,
+    ProviderUnavailableError,
+)
+from pydantic_prompter.instrumentation import record_usage
 from pydantic_prompter.llm_providers.bedrock_cohere import BedRockCohere
+from pydantic_prompter.llm_providers.clients import client_registry
 
 
 class Cohere(BedRockCohere):
-    def clean_result(self, body: str):
-        body = super().clean_result(body)
-        body = body.replace("<json>", "")
-        body = body.replace("<str>", "")
-        body = body.replace("<int>", "")
-        body = body.replace("<bool>", "")
-        return body
+    batch_api = False  # the bedrock format inherited from BedRockCohere
+    max_output_cap = None  # unlike on Bedrock, max_tokens can be left out
+
+    def _client(self):
+        import cohere
+
+        return client_registry.get(
+            "cohere",
+            (self.settings.cohere_key,),
+            lambda: cohere.Client(api_key=self.settings.cohere_key),
+        )
+
+    def _async_client(self):
+        import cohere
+
+        return client_registry.get_async(
+            "cohere-async",
+            (self.settings.cohere_key,),
+            lambda: cohere.AsyncClient(api_key=self.settings.cohere_key),
+        )
+
+    @staticmethod
+    def _error(e: Exception) -> Exception:
+        """Maps a cohere error to a retryable or a terminal exception"""
+        import httpx
+        from pydantic_prompter.retries import parse_retry_after
+
+        status = getattr(e, "status_code", None)
+        headers = getattr(e, "headers", None) or {}
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        if status == 429:
+            return ProviderThrottlingError(e, retry_after=retry_after)
+        if isinstance(e, httpx.TransportError) or (status or 0) >= 500:
+            return ProviderUnavailableError(e, retry_after=retry_after)
+        return CohereAuthenticationError(e)
+
+    @staticmethod
+    def _record_usage(response):
+        billed = getattr(getattr(response, "meta", None), "billed_units", None)
+        if billed is not None:
+            record_usage(
+                input_tokens=billed.input_tokens, output_tokens=billed.output_tokens
+            )
+
+    def _chat_args(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None],
+        return_type: Union[str, None],
+    ) -> dict:
+        args = dict(
+            message=self._build_prompt(messages, scheme or return_type),
+            temperature=self._temperature(0, 1),
+        )
+        max_tokens = self.preflight(messages, scheme, return_type)
+        if max_tokens is not None:
+            args["max_tokens"] = max_tokens
+        logger.debug("Request body: \n%s", args["message"])
+        return args
 
     def call(
         self,
@@ -21,23 +78,74 @@ class Cohere(BedRockCohere):
         scheme: Union[dict, None] = None,
         return_type: Union[str, None] = None,
     ) -> str:
+        args = self._chat_args(messages, scheme, return_type)
         try:
-            import cohere
+            response = self._client().chat(**args)
+        except Exception as e:
+            logger.warning(e)
+            raise self._error(e)
 
-            co = cohere.Client(api_key=self.settings.cohere_key)
-            content = self._build_prompt(messages, scheme or return_type)
+        self._record_usage(response)
+        answer = response.text
+        logger.debug("Got answer: \n%s", answer)
 
-            response = co.chat(
-                message=content,
-                temperature=random.uniform(0, 1),
-            )
-            logger.debug(f"Request body: \n{content}")
+        return answer
 
+    async def acall(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        args = self._chat_args(messages, scheme, return_type)
+        try:
+            response = await self._async_client().chat(**args)
         except Exception as e:
             logger.warning(e)
-            raise CohereAuthenticationError(e)
+            raise self._error(e)
 
+        self._record_usage(response)
         answer = response.text
-        logger.debug(f"Got answer: \n{answer}")
+        logger.debug("Got answer: \n%s", answer)
 
         return answer
+
+    def stream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> Iterator[str]:
+        args = self._chat_args(messages, scheme, return_type)
+        # the request is only sent once iteration starts, so errors surface
+        # from the loop as well as from the call
+        try:
+            events = self._client().chat_stream(**args)
+            try:
+                for event in events:
+                    if event.event_type == "text-generation":
+                        yield event.text
+            finally:
+                events.close()
+        except Exception as e:
+            logger.warning(e)
+            raise self._error(e)
+
+    async def astream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> AsyncIterator[str]:
+        args = self._chat_args(messages, scheme, return_type)
+        try:
+            events = self._async_client().chat_stream(**args)
+            try:
+                async for event in events:
+                    if event.event_type == "text-generation":
+                        yield event.text
+            finally:
+                await events.aclose()
+        except Exception as e:
+            logger.warning(e)
+            raise self._error(e)
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic_prompter.annotation_parser import AnnotationParser
+from pydantic_prompter.common import Message, logger
+from pydantic_prompter.exceptions import MockProviderError, ProviderThrottlingError
+from pydantic_prompter.instrumentation import record_usage
+from pydantic_prompter.llm_providers.base import LLM
+
+_SIMPLE_VALUES = {"str": "mock", "int": "1", "float": "1.0", "bool": "True"}
+
+
+def synthesize(schema: Dict[str, Any], defs: Optional[Dict[str, Any]] = None) -> Any:
+    """Builds a minimal value that validates against a JSON schema"""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return synthesize(defs[schema["$ref"].split("/")[-1]], defs)
+    if "default" in schema:
+        return schema["default"]
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"]
+            return synthesize((options or schema[key])[0], defs)
+
+    kind = schema.get("type", "object")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: synthesize(prop, defs) for name, prop in properties.items()}
+    if kind == "array":
+        items = schema.get("items")
+        return [synthesize(items, defs)] if items else []
+    if kind == "string":
+        return "x" * schema.get("minLength", 4)
+    if kind == "integer":
+        return schema.get("minimum", 1)
+    if kind == "number":
+        return float(schema.get("minimum", 1.0))
+    if kind == "boolean":
+        return True
+    return None
+
+
+class Mock(LLM):
+    """Offline stand-in provider, use ``llm="mock"`` with any model name.
+
+    Returns ``model_settings["response"]`` when given, otherwise a JSON value
+    synthesized from the return schema. ``latency`` and ``jitter`` (seconds)
+    simulate the round trip, ``error_rate`` makes that share of calls raise
+    ``MockProviderError``, ``throttle_rate`` makes that share of calls raise
+    the retryable ``ProviderThrottlingError`` and ``seed`` makes the
+    randomness reproducible.
+    """
+
+    batch_api = True
+
+    def __init__(
+        self,
+        model_name: str,
+        parser: AnnotationParser,
+        model_settings: Optional[Dict] = None,
+        deterministic: bool = False,
+    ):
+        super().__init__(model_name, parser, model_settings, deterministic)
+        self.options = model_settings or {}
+        self.latency = self.options.get("latency", 0.0)
+        self.jitter = self.options.get("jitter", 0.0)
+        self.error_rate = self.options.get("error_rate", 0.0)
+        self.throttle_rate = self.options.get("throttle_rate", 0.0)
+        self._random = random.Random(self.options.get("seed"))
+
+    def debug_prompt(self, messages: List[Message], scheme: Union[dict, str]) -> str:
+        return json.dumps([m.model_dump() for m in messages], indent=4, sort_keys=True)
+
+    def _delay(self) -> float:
+        return self.latency + self._random.uniform(0, self.jitter)
+
+    def _respond(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        if self._random.random() < self.error_rate:
+            raise MockProviderError("simulated provider error")
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            raise ProviderThrottlingError("simulated throttling", retry_after=0.0)
+        if "response" in self.options:
+            response = self.options["response"]
+            return response if isinstance(response, str) else json.dumps(response)
+        if return_type:
+            return _SIMPLE_VALUES.get(return_type, "")
+        return json.dumps(synthesize(scheme["parameters"]))
+
+    @staticmethod
+    def _record_usage(messages: List[Message], response: str):
+        # rough 4 characters per token, enough to exercise usage aggregation
+        record_usage(
+            input_tokens=sum(len(m.content) for m in messages) // 4,
+            output_tokens=len(response) // 4,
+        )
+
+    def batch_record(
+        self,
+        custom_id: str,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> dict:
+        return {
+            "custom_id": custom_id,
+            "messages": [m.model_dump() for m in messages],
+            "scheme": scheme,
+            "return_type": return_type,
+        }
+
+    def batch_respond(self, record: dict) -> dict:
+        """Answers a ``batch_record`` line, a responder for ``LocalBackend``"""
+        messages = [Message(**m) for m in record["messages"]]
+        try:
+            response = self._respond(messages, record["scheme"], record["return_type"])
+        except Exception as e:
+            return {"custom_id": record["custom_id"], "error": str(e)}
+        return {"custom_id": record["custom_id"], "response": response}
+
+    def batch_output(self, record: dict) -> Tuple[str, Optional[str], Optional[str]]:
+        return record["custom_id"], record.get("response"), record.get("error")
+
+    def call(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        self.preflight(messages, scheme, return_type)
+        time.sleep(self._delay())
+        response = self._respond(messages, scheme, return_type)
+        self._record_usage(messages, response)
+        return response
+
+    async def acall(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        self.preflight(messages, scheme, return_type)
+        await asyncio.sleep(self._delay())
+        response = self._respond(messages, scheme, return_type)
+        self._record_usage(messages, response)
+        return response
+
+
+class Replay(Mock):
+    """Replays recorded responses from a JSON lines file, use ``llm="replay"``.
+
+    Each line holds a ``response`` and optionally the ``key`` of the prompt
+    it answers (see ``Replay.key``). Prompts with a recorded key get their
+    own response, any other prompt gets the next un-keyed response in a
+    loop. ``model_settings["path"]`` points to the file, the latency, jitter
+    and error options of ``Mock`` apply as well.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        parser: AnnotationParser,
+        model_settings: Optional[Dict] = None,
+        deterministic: bool = False,
+    ):
+        super().__init__(model_name, parser, model_settings, deterministic)
+        self._keyed: Dict[str, str] = {}
+        sequential = []
+        with open(self.options["path"]) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("key"):
+                    self._keyed[record["key"]] = record["response"]
+                else:
+                    sequential.append(record["response"])
+        self._lock = threading.Lock()
+        self._sequential = itertools.cycle(sequential) if sequential else None
+
+    @staticmethod
+    def key(messages: List[Message], scheme: Union[dict, str, None]) -> str:
+        payload = json.dumps(
+            [[[m.role, m.content] for m in messages], scheme], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @classmethod
+    def record(
+        cls,
+        path: str,
+        messages: List[Message],
+        scheme: Union[dict, str, None],
+        response: str,
+    ):
+        """Appends a keyed response to a replay file"""
+        with open(path, "a") as f:
+            record = {"key": cls.key(messages, scheme), "response": response}
+            f.write(json.dumps(record) + "\n")
+
+    def _respond(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        if self._random.random() < self.error_rate:
+            raise MockProviderError("simulated provider error")
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            raise ProviderThrottlingError("simulated throttling", retry_after=0.0)
+        response = self._keyed.get(self.key(messages, scheme or return_type))
+        if response is not None:
+            return response
+        if self._sequential is None:
+            raise MockProviderError("no recorded response for prompt")
+        logger.debug("No keyed recording for prompt, replaying next response")
+        with self._lock:
+            return next(self._sequential)
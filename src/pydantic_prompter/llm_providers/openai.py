@@ -1,17 +1,24 @@
+import hashlib
 import json
-import random
-from typing import List, Union
+from typing import List, Optional, Union, Iterator, AsyncIterator, Tuple
 
 from pydantic_prompter.common import Message, logger
-from pydantic_prompter.exceptions import OpenAiAuthenticationError
+from pydantic_prompter.exceptions import (
+    OpenAiAuthenticationError,
+    ProviderThrottlingError,
+    ProviderUnavailableError,
+)
+from pydantic_prompter.instrumentation import record_usage
 from pydantic_prompter.llm_providers.base import LLM
+from pydantic_prompter.llm_providers.clients import client_registry
 
 
 class OpenAI(LLM):
+    batch_api = True
+
     @staticmethod
     def to_openai_format(msgs: List[Message]):
-        openai_msgs = [item.model_dump() for item in msgs]
-        return openai_msgs
+        return [{"role": m.role, "content": m.content} for m in msgs]
 
     def debug_prompt(self, messages: List[Message], scheme: dict) -> str:
         return json.dumps(self.to_openai_format(messages), indent=4, sort_keys=True)
@@ -40,33 +47,198 @@ class OpenAI(LLM):
         }
         return simple
 
-    def call(
+    def _client(self):
+        from openai import OpenAI
+
+        return client_registry.get(
+            "openai",
+            (self.settings.openai_api_key,),
+            lambda: OpenAI(api_key=self.settings.openai_api_key),
+        )
+
+    def _async_client(self):
+        from openai import AsyncOpenAI
+
+        return client_registry.get_async(
+            "openai-async",
+            (self.settings.openai_api_key,),
+            lambda: AsyncOpenAI(api_key=self.settings.openai_api_key),
+        )
+
+    @staticmethod
+    def _error(e: Exception) -> Exception:
+        """Maps an openai error to a retryable or a terminal exception"""
+        from openai import APIConnectionError, APIStatusError, RateLimitError
+        from pydantic_prompter.retries import parse_retry_after
+
+        retry_after = None
+        if isinstance(e, APIStatusError):
+            retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+        if isinstance(e, RateLimitError):
+            return ProviderThrottlingError(e, retry_after=retry_after)
+        if isinstance(e, APIConnectionError) or (
+            isinstance(e, APIStatusError) and e.status_code >= 500
+        ):
+            return ProviderUnavailableError(e, retry_after=retry_after)
+        return OpenAiAuthenticationError(e)
+
+    @staticmethod
+    def _record_usage(chat_completion):
+        usage = chat_completion.usage
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            record_usage(
+                input_tokens=usage.prompt_tokens,
+                output_tokens=usage.completion_tokens,
+                cache_read_input_tokens=getattr(details, "cached_tokens", None),
+            )
+
+    _scheme_digest: Optional[str] = None
+
+    def _digest(self, scheme: dict) -> str:
+        # the parser's own schema is hashed once, from its cached JSON
+        if scheme is self.parser.llm_schema():
+            if self._scheme_digest is None:
+                schema_json = self.parser.llm_schema_json().encode()
+                self._scheme_digest = hashlib.sha256(schema_json).hexdigest()
+            return self._scheme_digest
+        return hashlib.sha256(json.dumps(scheme).encode()).hexdigest()
+
+    def _prompt_cache_key(self, scheme: dict, messages: List[Message]) -> str:
+        """Identifies the static prefix, the function schema and leading system
+        messages, so requests sharing it are routed to the same prompt cache"""
+        key = hashlib.sha256(self._digest(scheme).encode())
+        for message in messages:
+            if message.role != "system":
+                break
+            key.update(message.content.encode())
+        return key.hexdigest()[:32]
+
+    def _request(
         self,
         messages: List[Message],
         scheme: Union[dict, None] = None,
         return_type: Union[str, None] = None,
-    ) -> str:
-        from openai import OpenAI, OpenAIError
-        from openai import AuthenticationError, APIConnectionError
-
+    ) -> dict:
+        max_tokens = self.preflight(messages, scheme, return_type)
         if return_type:
             scheme = self._create_schema(return_type)
 
         _function_call = {
             "name": scheme["name"],
         }
-        logger.debug(f"Openai Functions: \n [{scheme}]")
-        logger.debug(f"Openai function_call: \n {_function_call}")
-        messages_oai = self.to_openai_format(messages)
+        logger.debug("Openai Functions: \n [%s]", scheme)
+        logger.debug("Openai function_call: \n %s", _function_call)
+        request = dict(
+            model=self.model_name,
+            messages=self.to_openai_format(messages),
+            functions=[scheme],
+            function_call=_function_call,
+            temperature=self._temperature(0.3, 1.3),
+        )
+        if max_tokens is not None:
+            request["max_tokens"] = max_tokens
+        if self.settings.prompt_cache:
+            # sent as a raw body field, older client versions lack the argument
+            key = self._prompt_cache_key(scheme, messages)
+            request["extra_body"] = {"prompt_cache_key": key}
+        return request
+
+    def batch_record(
+        self,
+        custom_id: str,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> dict:
+        body = self._request(messages, scheme, return_type)
+        body.update(body.pop("extra_body", {}))
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        }
+
+    def batch_output(self, record: dict) -> Tuple[str, Optional[str], Optional[str]]:
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code", 200) != 200:
+            return record["custom_id"], None, str(record.get("error") or response)
+        message = response["body"]["choices"][0]["message"]
+        return record["custom_id"], message["function_call"]["arguments"], None
+
+    def call(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        from openai import OpenAIError
+
+        request = self._request(messages, scheme, return_type)
         try:
-            client = OpenAI(api_key=self.settings.openai_api_key)
-            chat_completion = client.chat.completions.create(
-                model=self.model_name,
-                messages=messages_oai,
-                functions=[scheme],
-                function_call=_function_call,
-                temperature=random.uniform(0.3, 1.3),
-            )
-        except (AuthenticationError, APIConnectionError, OpenAIError) as e:
-            raise OpenAiAuthenticationError(e)
+            client = self._client()
+            chat_completion = client.chat.completions.create(**request)
+        except OpenAIError as e:
+            raise self._error(e)
+        self._record_usage(chat_completion)
         return chat_completion.choices[0].message.function_call.arguments
+
+    async def acall(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> str:
+        from openai import OpenAIError
+
+        request = self._request(messages, scheme, return_type)
+        try:
+            client = self._async_client()
+            chat_completion = await client.chat.completions.create(**request)
+        except OpenAIError as e:
+            raise self._error(e)
+        self._record_usage(chat_completion)
+        return chat_completion.choices[0].message.function_call.arguments
+
+    def stream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> Iterator[str]:
+        from openai import OpenAIError
+
+        request = self._request(messages, scheme, return_type)
+        try:
+            response = self._client().chat.completions.create(**request, stream=True)
+        except OpenAIError as e:
+            raise self._error(e)
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.function_call:
+                    yield chunk.choices[0].delta.function_call.arguments or ""
+        finally:
+            # stop generating (and billing) when the caller stops reading
+            response.close()
+
+    async def astream(
+        self,
+        messages: List[Message],
+        scheme: Union[dict, None] = None,
+        return_type: Union[str, None] = None,
+    ) -> AsyncIterator[str]:
+        from openai import OpenAIError
+
+        request = self._request(messages, scheme, return_type)
+        try:
+            client = self._async_client()
+            response = await client.chat.completions.create(**request, stream=True)
+        except OpenAIError as e:
+            raise self._error(e)
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.function_call:
+                    yield chunk.choices[0].delta.function_call.arguments or ""
+        finally:
+            await response.close()
@@ -0,0 +1,81 @@
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic_prompter.common import Message
+
+# role markers that start a line in the docstring, e.g. "- user:"
+_ROLE_MARKER = re.compile(r"^[ \t]*-[ \t]*(user|system|assistant):", re.MULTILINE)
+# free form role parsing, used for content that is only known after rendering
+_ROLE_PATTERN = re.compile(
+    r"-.*?(user|system|assistant):(.*?)(?=- \w+:|\Z)", re.DOTALL | re.MULTILINE
+)
+
+
+def parse_messages(content: str) -> List[Message]:
+    return [
+        Message(role=role, content=text.strip())
+        for role, text in _ROLE_PATTERN.findall(content)
+    ]
+
+
+class MessagePlan:
+    """Docstring split into ``(role, template fragment)`` segments once, at
+    decoration time, so a call only substitutes variables.
+
+    Because each fragment is rendered on its own, inputs that contain text
+    like ``- user:`` can no longer change the message structure. Text before
+    the first role (e.g. ``{history}``) is still rendered and parsed for
+    roles, which is how conversation history is injected. Jinja docstrings
+    with block tags (``{% ... %}``) inside the role section may span
+    several roles, so those fall back to rendering the whole docstring.
+    """
+
+    def __init__(self, doc: str, jinja: bool):
+        self.jinja = jinja
+        self._whole: Optional[Callable[[Dict], str]] = None
+        self._preamble: Optional[Callable[[Dict], str]] = None
+        self._preamble_messages: List[Message] = []
+        self._segments: List[Tuple[str, Callable[[Dict], str]]] = []
+
+        markers = list(_ROLE_MARKER.finditer(doc))
+        preamble = doc[: markers[0].start()] if markers else doc
+        if jinja and "{%" in doc[len(preamble) :]:
+            self._whole = self._compile(doc)
+            return
+
+        if self._is_template(preamble):
+            self._preamble = self._compile(preamble)
+        else:
+            self._preamble_messages = parse_messages(preamble)
+
+        for marker, following in zip(markers, markers[1:] + [None]):
+            end = following.start() if following else len(doc)
+            fragment = doc[marker.end() : end]
+            self._segments.append((marker.group(1), self._compile(fragment)))
+
+    def _is_template(self, text: str) -> bool:
+        if self.jinja:
+            return "{{" in text or "{%" in text or "{#" in text
+        return "{" in text
+
+    def _compile(self, text: str) -> Callable[[Dict], str]:
+        if not self._is_template(text):
+            return lambda inputs: text
+        if self.jinja:
+            # jinja is only imported by functions that use it
+            from pydantic_prompter.templates import string_template
+
+            return string_template(text).render
+        return lambda inputs: text.format(**inputs)
+
+    def render(self, **inputs) -> List[Message]:
+        if self._whole:
+            return parse_messages(self._whole(inputs))
+
+        if self._preamble:
+            messages = parse_messages(self._preamble(inputs))
+        else:
+            messages = list(self._preamble_messages)
+        for role, fragment in self._segments:
+            messages.append(Message(role=role, content=fragment(inputs).strip()))
+        return messages
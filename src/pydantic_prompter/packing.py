@@ -0,0 +1,90 @@
+from json import JSONDecodeError
+from typing import Any, Dict, List, Type, Union
+
+from pydantic import BaseModel, ValidationError, create_model
+
+from pydantic_prompter.annotation_parser import PydanticParser, _loads
+from pydantic_prompter.common import Message
+from pydantic_prompter.exceptions import FailedToCastLLMResult
+
+PACK_PROMPT = (
+    "Handle each of the {count} requests below on its own. Reply with one "
+    'entry in "items" per request, holding the request "id" and its "result".'
+)
+DEFAULT_PACK_SIZE = 10
+
+_packed_models: Dict[type, Type[BaseModel]] = {}
+
+
+def packed_model(return_cls: Type[BaseModel]) -> Type[BaseModel]:
+    """``{"items": [{"id": ..., "result": <return_cls>}, ...]}``"""
+    model = _packed_models.get(return_cls)
+    if model is None:
+        item = create_model(
+            f"Packed{return_cls.__name__}Item", id=(str, ...), result=(return_cls, ...)
+        )
+        model = create_model(f"Packed{return_cls.__name__}", items=(List[item], ...))
+        _packed_models[return_cls] = model
+    return model
+
+
+def packed_schema(return_cls: Type[BaseModel]) -> dict:
+    return PydanticParser.pydantic_schema(
+        packed_model(return_cls).model_json_schema(mode="serialization")
+    )
+
+
+def pack_messages(conversations: List[List[Message]]) -> List[Message]:
+    """Merges the rendered messages of several input sets into one prompt.
+
+    Messages every conversation starts with (usually the system prompt) are
+    sent once, the rest of each conversation becomes a numbered request in
+    a single user message. Request ids are the positions in
+    ``conversations``.
+    """
+    shortest = min(len(c) for c in conversations)
+    shared = 0
+    # each request keeps at least its last message
+    while shared < shortest - 1 and all(
+        c[shared] == conversations[0][shared] for c in conversations
+    ):
+        shared += 1
+
+    parts = [PACK_PROMPT.format(count=len(conversations))]
+    for index, conversation in enumerate(conversations):
+        rest = conversation[shared:]
+        if len(rest) == 1 and rest[0].role == "user":
+            body = rest[0].content
+        else:
+            body = "\n".join(str(m) for m in rest)
+        parts.append(f'## Request id "{index}"\n{body}')
+    return conversations[0][:shared] + [
+        Message(role="user", content="\n\n".join(parts))
+    ]
+
+
+def unpack(
+    return_cls: Type[BaseModel], clean_result: str, count: int
+) -> List[Union[BaseModel, FailedToCastLLMResult]]:
+    """Validates each request's result on its own.
+
+    Returns a result or an error per request id, so one bad item does not
+    fail the others. Raises FailedToCastLLMResult when the reply as a whole
+    cannot be read.
+    """
+    try:
+        items = _loads(clean_result)["items"]
+        by_id: Dict[str, Any] = {str(item["id"]): item.get("result") for item in items}
+    except (JSONDecodeError, KeyError, TypeError) as e:
+        raise FailedToCastLLMResult(e)
+
+    results = []
+    for index in range(count):
+        if str(index) not in by_id:
+            results.append(FailedToCastLLMResult(f"no result for request {index}"))
+            continue
+        try:
+            results.append(return_cls.model_validate(by_id[str(index)]))
+        except ValidationError as e:
+            results.append(FailedToCastLLMResult(e))
+    return results
@@ -1,102 +1,720 @@
-from typing import List, Optional, Dict
-
-from jinja2 import Template
-from retry import retry
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    List,
+    Optional,
+    Dict,
+    Iterable,
+    Iterator,
+    AsyncIterator,
+    Callable,
+    Sequence,
+    Tuple,
+)
 
-from pydantic_prompter.annotation_parser import AnnotationParser
+from pydantic_prompter import batch, packing
+from pydantic_prompter.annotation_parser import (
+    AnnotationParser,
+    PydanticParser,
+    error_summary,
+)
+from pydantic_prompter.batch import BatchItem, DEFAULT_CONCURRENCY
+from pydantic_prompter.bulk import BulkBackend, BulkJob
+from pydantic_prompter.cache import ResponseCache, cache_key
+from pydantic_prompter.coalesce import SingleFlight
 from pydantic_prompter.common import logger, Message, LLMDataAndResult
 from pydantic_prompter.exceptions import (
     ArgumentError,
-    BadRoleError,
-    Retryable,
+    BulkRecordError,
+    FailedToCastLLMResult,
 )
+from pydantic_prompter.instrumentation import Instrument, Recorder, stage
 from pydantic_prompter.llm_providers import get_llm
 from pydantic_prompter.llm_providers.base import LLM
+from pydantic_prompter.message_plan import MessagePlan
+from pydantic_prompter.rate_limit import rate_limits
+from pydantic_prompter.retries import RetryPolicy
+from pydantic_prompter.routing import DEFAULT_WORKERS, FALLBACK, HEDGE, Router, Target
+from pydantic_prompter.streaming import JsonStreamParser
+
+RETRY_TRIES = 3
+RETRY_DELAY = 1
+REPAIR_PROMPT = (
+    "Your previous reply could not be used:\n{errors}\n"
+    "Reply again with the corrected output only, keep the valid parts unchanged."
+)
 
 
 class _Pr:
-    def __init__(self, function, llm: str, model_name: str, jinja: bool, model_settings: Optional[Dict] = None):
+    def __init__(
+        self,
+        function,
+        llm: str,
+        model_name: str,
+        jinja: bool,
+        model_settings: Optional[Dict] = None,
+        cache: Optional[ResponseCache] = None,
+        deterministic: bool = False,
+        log_hook: Optional[Callable[[LLMDataAndResult], None]] = None,
+        instrument: Optional[Instrument] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        repair: int = 0,
+        targets: Optional[Sequence[Tuple]] = None,
+        routing: str = FALLBACK,
+        hedge_delay: Optional[float] = None,
+        target_timeout: Optional[float] = None,
+        route_workers: int = DEFAULT_WORKERS,
+        coalesce: bool = False,
+    ):
+        if routing not in (FALLBACK, HEDGE):
+            raise ArgumentError(f"routing must be {FALLBACK!r} or {HEDGE!r}")
         self.jinja = jinja
+        self.repair = repair
         self.function = function
+        self.cache = cache
+        self.log_hook = log_hook
+        self.instrument = instrument
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_attempts=RETRY_TRIES, base_delay=RETRY_DELAY
+        )
+        self._plan = MessagePlan(function.__doc__, jinja)
         self.parser = AnnotationParser.get_parser(function)
-        self.llm = get_llm(llm=llm, parser=self.parser, model_name=model_name, model_settings=model_settings)
+        self.targets = [
+            Target(
+                provider,
+                get_llm(
+                    llm=provider,
+                    parser=self.parser,
+                    model_name=name,
+                    model_settings=settings,
+                    deterministic=deterministic,
+                ),
+            )
+            for provider, name, settings in [(llm, model_name, model_settings)]
+            + [tuple(target) + (None,) * (3 - len(target)) for target in targets or []]
+        ]
+        self.single_flight = SingleFlight() if coalesce else None
+        self.router = None
+        if len(self.targets) > 1:
+            self.router = Router(
+                self.targets,
+                routing,
+                hedge_delay,
+                target_timeout,
+                max_workers=route_workers,
+            )
+
+    @property
+    def llm(self) -> LLM:
+        """The primary target's provider"""
+        return self.targets[0].llm
+
+    @llm.setter
+    def llm(self, llm: LLM):
+        self.targets[0].llm = llm
+
+    @property
+    def provider(self) -> str:
+        return self.targets[0].provider
 
-    @retry(tries=3, delay=1, logger=logger, exceptions=(Retryable,))
     def __call__(self, *args, **inputs):
         if args:
             raise ArgumentError("please use only kwargs")
 
+        messages = []
+
+        def attempt(number: int):
+            llm_data = LLMDataAndResult(inputs=inputs, retries=number - 1)
+            with self._recording(llm_data):
+                self._prepare_once(llm_data, messages)
+                res: LLMDataAndResult = self.call_llm(llm_data)
+            return self._finish(res)
+
+        return self.retry_policy.run(attempt)
+
+    async def acall(self, *args, **inputs):
+        """Awaitable counterpart of calling the decorated function.
+
+        Uses the provider's native async client where one exists and backs
+        off with ``asyncio.sleep`` between retries, so the event loop is
+        never blocked.
+        """
+        if args:
+            raise ArgumentError("please use only kwargs")
+
+        messages = []
+
+        async def attempt(number: int):
+            llm_data = LLMDataAndResult(inputs=inputs, retries=number - 1)
+            with self._recording(llm_data):
+                self._prepare_once(llm_data, messages)
+                res: LLMDataAndResult = await self.acall_llm(llm_data)
+            return self._finish(res)
+
+        return await self.retry_policy.arun(attempt)
+
+    def _prepare_once(self, llm_data: LLMDataAndResult, messages: List[Message]):
+        # the prompt is rendered on the first attempt only, retries reuse it
+        if messages:
+            llm_data.messages = list(messages)
+        else:
+            self._prepare(llm_data)
+            messages.extend(llm_data.messages)
+
+    def stream(self, *args, **inputs) -> Iterator:
+        """Yields partial results while the reply streams in, then the result.
+
+        A partial result is the return model built from the top-level fields
+        that are complete and valid so far, and is yielded each time a new
+        field completes. The provider stream is closed as soon as the JSON
+        object closes. Streaming calls are not retried.
+        """
+        if args:
+            raise ArgumentError("please use only kwargs")
+
+        llm_data = LLMDataAndResult(inputs=inputs)
+        recorder = Recorder(llm_data)
+        json_stream = JsonStreamParser()
+        try:
+            with recorder.active():
+                self._prepare(llm_data)
+            partials = self._stream_partials(llm_data, json_stream)
+            try:
+                while True:
+                    # active only while the stream runs, not while the caller
+                    # holds a partial result
+                    with recorder.active():
+                        partial = next(partials, None)
+                    if partial is None:
+                        break
+                    yield partial
+            finally:
+                with recorder.active():
+                    partials.close()
+            with recorder.active():
+                res = self._parse_result(llm_data, json_stream.text)
+        finally:
+            recorder.finish(self.instrument)
+        yield self._finish(res)
+
+    async def astream(self, *args, **inputs) -> AsyncIterator:
+        """Async counterpart of ``stream``"""
+        if args:
+            raise ArgumentError("please use only kwargs")
+
         llm_data = LLMDataAndResult(inputs=inputs)
-        llm_data.messages = self._parse_function_to_messages(**inputs)
-        logger.debug(f"Calling with prompt:\n{self.build_string(**inputs)}")
-        res: LLMDataAndResult = self.call_llm(llm_data)
+        recorder = Recorder(llm_data)
+        json_stream = JsonStreamParser()
+        try:
+            with recorder.active():
+                self._prepare(llm_data)
+            partials = self._astream_partials(llm_data, json_stream)
+            try:
+                while True:
+                    with recorder.active():
+                        try:
+                            partial = await partials.__anext__()
+                        except StopAsyncIteration:
+                            break
+                    yield partial
+            finally:
+                with recorder.active():
+                    await partials.aclose()
+            with recorder.active():
+                res = self._parse_result(llm_data, json_stream.text)
+        finally:
+            recorder.finish(self.instrument)
+        yield self._finish(res)
+
+    def _stream_partials(
+        self, llm_data: LLMDataAndResult, json_stream: JsonStreamParser
+    ) -> Iterator:
+        with self._rate_limited(self.targets[0], llm_data), stage("request"):
+            chunks = self.llm.stream(llm_data.messages, **self._return_spec())
+            try:
+                for chunk in chunks:
+                    partial = self._stream_step(json_stream, chunk)
+                    if partial is not None:
+                        yield partial
+                    if json_stream.complete:
+                        break
+            finally:
+                chunks.close()
+
+    async def _astream_partials(
+        self, llm_data: LLMDataAndResult, json_stream: JsonStreamParser
+    ) -> AsyncIterator:
+        async with self._arate_limited(self.targets[0], llm_data):
+            with stage("request"):
+                chunks = self.llm.astream(llm_data.messages, **self._return_spec())
+                try:
+                    async for chunk in chunks:
+                        partial = self._stream_step(json_stream, chunk)
+                        if partial is not None:
+                            yield partial
+                        if json_stream.complete:
+                            break
+                finally:
+                    await chunks.aclose()
+
+    def _stream_step(self, json_stream: JsonStreamParser, chunk: str):
+        # the final, fully validated result is yielded once the stream ends
+        if json_stream.feed(chunk) and not json_stream.complete:
+            return self.parser.cast_partial(json_stream.fields())
+        return None
+
+    def map(
+        self, inputs: Iterable[Dict], concurrency: int = DEFAULT_CONCURRENCY
+    ) -> List[BatchItem]:
+        """Runs the prompt over many input sets on a bounded thread pool.
+
+        Returns one BatchItem per input, in input order, holding either the
+        result or the error, so a single failing item never aborts the batch.
+        """
+        return sorted(self.imap(inputs, concurrency), key=lambda item: item.index)
+
+    def imap(
+        self, inputs: Iterable[Dict], concurrency: int = DEFAULT_CONCURRENCY
+    ) -> Iterator[BatchItem]:
+        """Like ``map`` but yields each BatchItem as soon as it completes"""
+        return batch.imap(self, inputs, concurrency)
+
+    async def amap(
+        self, inputs: Iterable[Dict], concurrency: int = DEFAULT_CONCURRENCY
+    ) -> List[BatchItem]:
+        """Awaitable ``map`` bounding in-flight ``acall``s with ``concurrency``"""
+        items = [item async for item in self.aimap(inputs, concurrency)]
+        return sorted(items, key=lambda item: item.index)
+
+    def aimap(
+        self, inputs: Iterable[Dict], concurrency: int = DEFAULT_CONCURRENCY
+    ) -> AsyncIterator[BatchItem]:
+        """Async iterator yielding each BatchItem as soon as it completes"""
+        return batch.aimap(self.acall, inputs, concurrency)
+
+    def pack(
+        self,
+        inputs: Iterable[Dict],
+        size: int = packing.DEFAULT_PACK_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        rounds: int = 3,
+    ) -> List[BatchItem]:
+        """Like ``map`` but sends up to ``size`` input sets per request.
+
+        The shared start of the prompt and the schema are sent once per
+        request instead of once per input, which pays off for many small
+        inputs such as classification. Each item is validated on its own and
+        only the items that failed are packed again, for up to ``rounds``
+        rounds. Only Pydantic return types can be packed.
+        """
+        todo, done = self._pack_todo(inputs), {}
+        for last in [False] * (rounds - 1) + [True]:
+            groups = self._pack_groups(todo, size)
+            todo = []
+            for group in batch.imap(self._call_pack, groups, concurrency):
+                todo += self._pack_collect(group, done, last)
+            if not todo:
+                break
+        return [done[index] for index in sorted(done)]
+
+    async def apack(
+        self,
+        inputs: Iterable[Dict],
+        size: int = packing.DEFAULT_PACK_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        rounds: int = 3,
+    ) -> List[BatchItem]:
+        """Awaitable ``pack``"""
+        todo, done = self._pack_todo(inputs), {}
+        for last in [False] * (rounds - 1) + [True]:
+            groups = self._pack_groups(todo, size)
+            todo = []
+            async for group in batch.aimap(self._acall_pack, groups, concurrency):
+                todo += self._pack_collect(group, done, last)
+            if not todo:
+                break
+        return [done[index] for index in sorted(done)]
 
+    def _pack_todo(self, inputs: Iterable[Dict]) -> List[Tuple[int, Dict]]:
+        if not isinstance(self.parser, PydanticParser):
+            raise ArgumentError("packing needs a Pydantic return type")
+        return list(enumerate(inputs))
+
+    @staticmethod
+    def _pack_groups(todo: List[Tuple[int, Dict]], size: int) -> List[Dict]:
+        return [{"group": todo[i : i + size]} for i in range(0, len(todo), size)]
+
+    @staticmethod
+    def _pack_collect(group: BatchItem, done: Dict, last: bool) -> List:
+        """Files the items of a finished request, returns those to pack again"""
+        if not group.ok:  # the request itself failed, after retries
+            for index, inputs in group.inputs["group"]:
+                done[index] = BatchItem(index=index, inputs=inputs, error=group.error)
+            return []
+        retry = []
+        for item in group.result:
+            if item.ok or last:
+                done[item.index] = item
+            else:
+                retry.append((item.index, item.inputs))
+        return retry
+
+    def _pack_request(self, group: List[Tuple[int, Dict]]):
+        conversations = [self._parse_function_to_messages(**kw) for _, kw in group]
+        messages = packing.pack_messages(conversations)
+        scheme = packing.packed_schema(self.parser.return_cls)
+        return messages, scheme
+
+    def _pack_results(self, group, llm_data: LLMDataAndResult) -> List[BatchItem]:
+        with stage("clean"):
+            llm_data.clean_result = self.llm.clean_result(llm_data.raw_result)
+        with stage("cast"):
+            results = packing.unpack(
+                self.parser.return_cls, llm_data.clean_result, len(group)
+            )
+        return [
+            (
+                BatchItem(index=index, inputs=inputs, error=res)
+                if isinstance(res, Exception)
+                else BatchItem(index=index, inputs=inputs, result=res)
+            )
+            for (index, inputs), res in zip(group, results)
+        ]
+
+    def _call_pack(self, group: List[Tuple[int, Dict]]) -> List[BatchItem]:
+        messages, scheme = self._pack_request(group)
+
+        def attempt(number: int):
+            llm_data = LLMDataAndResult(
+                inputs={"group": group}, messages=messages, retries=number - 1
+            )
+            with self._recording(llm_data):
+                with self._rate_limited(self.targets[0], llm_data), stage("request"):
+                    llm_data.raw_result = self.llm.call(messages, scheme=scheme)
+                return self._pack_results(group, llm_data)
+
+        return self.retry_policy.run(attempt)
+
+    async def _acall_pack(self, group: List[Tuple[int, Dict]]) -> List[BatchItem]:
+        messages, scheme = self._pack_request(group)
+
+        async def attempt(number: int):
+            llm_data = LLMDataAndResult(
+                inputs={"group": group}, messages=messages, retries=number - 1
+            )
+            with self._recording(llm_data):
+                async with self._arate_limited(self.targets[0], llm_data):
+                    with stage("request"):
+                        llm_data.raw_result = await self.llm.acall(
+                            messages, scheme=scheme
+                        )
+                return self._pack_results(group, llm_data)
+
+        return await self.retry_policy.arun(attempt)
+
+    def bulk(self, inputs: Iterable[Dict], backend: BulkBackend) -> BulkJob:
+        """Submits every input set as one offline provider batch job.
+
+        Provider batch APIs trade latency (results within hours) for a lower
+        price and no rate limits, which suits backfills. Poll with
+        ``job.wait()`` and read ``job.results()``, one BatchItem per input.
+        To pick a job up later, e.g. from another process, build
+        ``BulkJob(prompter, backend, job_id)``.
+        """
+        if not self.llm.batch_api:
+            raise ArgumentError(f"{type(self.llm).__name__} has no batch API")
+        spec = self._return_spec()
+        job_inputs, records = {}, []
+        for index, kwargs in enumerate(inputs):
+            custom_id = f"{index:011d}"  # bedrock wants 11 character record ids
+            job_inputs[custom_id] = kwargs
+            messages = self._parse_function_to_messages(**kwargs)
+            records.append(self.llm.batch_record(custom_id, messages, **spec))
+        return BulkJob(self, backend, backend.submit(self.llm, records), job_inputs)
+
+    def _bulk_results(self, job: BulkJob) -> Iterator[BatchItem]:
+        for record in job.backend.results(job.id):
+            custom_id, text, error = self.llm.batch_output(record)
+            item = BatchItem(index=int(custom_id), inputs=job.inputs.get(custom_id, {}))
+            if error is not None:
+                item.error = BulkRecordError(error)
+            else:
+                llm_data = self._parse_result(
+                    LLMDataAndResult(inputs=item.inputs), text
+                )
+                item.result, item.error = llm_data.result, llm_data.error
+            yield item
+
+    @contextmanager
+    def _recording(self, llm_data: LLMDataAndResult):
+        recorder = Recorder(llm_data)
+        try:
+            with recorder.active():
+                yield recorder
+        finally:
+            recorder.finish(self.instrument)
+
+    def _prepare(self, llm_data: LLMDataAndResult) -> LLMDataAndResult:
+        with stage("render"):
+            llm_data.messages = self._parse_function_to_messages(**llm_data.inputs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Calling with prompt:\n%s", self._debug_prompt(llm_data.messages)
+            )
+        return llm_data
+
+    def _finish(self, res: LLMDataAndResult):
+        if self.log_hook:
+            try:
+                self.log_hook(res)
+            except Exception:
+                logger.exception("log_hook failed")
         if res.error:
-            logger.error(f"\n\n ----> START OF ERROR <---- ")
-            logger.exception(llm_data.error)
-            logger.error(f"\n\nError ----> \n\n{type(res.error)}: {res.error}")
-            logger.error(f"\n\nLLM output ----> \n\n{res.raw_result}")
-            logger.error(f"\n\nLLM clean output ----> \n\n{res.clean_result}")
-            logger.error(f"\n\nPrompt ----> \n\n{self.build_string(**inputs)}")
-            logger.error(f"\n\n ----> END OF ERROR <---- ")
+            logger.error("\n\n ----> START OF ERROR <---- ")
+            logger.exception(res.error)
+            logger.error("\n\nError ----> \n\n%s: %s", type(res.error), res.error)
+            logger.error("\n\nLLM output ----> \n\n%s", res.raw_result)
+            logger.error("\n\nLLM clean output ----> \n\n%s", res.clean_result)
+            logger.error("\n\nPrompt ----> \n\n%s", self._debug_prompt(res.messages))
+            logger.error("\n\n ----> END OF ERROR <---- ")
             raise res.error
         return res.result
 
     def build_string(self, **inputs) -> str:
-        msgs = self._parse_function_to_messages(**inputs)
-        res = self.llm.debug_prompt(
-            msgs, self.parser.llm_schema() or self.parser.llm_return_type()
-        )
+        return self._debug_prompt(self._parse_function_to_messages(**inputs))
 
-        return res
+    def _debug_prompt(self, messages: List[Message]) -> str:
+        return self.llm.debug_prompt(
+            messages, self.parser.llm_schema() or self.parser.llm_return_type()
+        )
 
     def _parse_function_to_messages(self, **inputs) -> List[Message]:
-        if self.jinja:
-            template = Template(self.function.__doc__, keep_trailing_newline=True)
-            content = template.render(**inputs)
-        else:
-            content = self.function.__doc__.format(**inputs)
+        return self._plan.render(**inputs)
 
-        import re
+    def _return_spec(self) -> Dict:
+        scheme = self.parser.llm_schema()
+        if scheme:  # pydantic schema
+            return {"scheme": scheme}
+        return {"return_type": self.parser.llm_return_type()}  # simple typings
 
-        pattern = r"-.*?(user|system|assistant):(.*?)(?=- \w+:|\Z)"
-        matches = re.findall(pattern, content, re.DOTALL | re.MULTILINE)
-        result = [(m[0], m[1].strip()) for m in matches]
+    def _key(self, llm_data: LLMDataAndResult, spec: Dict) -> str:
+        return cache_key(
+            llm_data.messages,
+            spec.get("scheme") or spec.get("return_type"),
+            type(self.llm).__name__,
+            self.llm.model_name,
+            self.llm.model_settings,
+        )
 
-        messages = []
+    def _from_cache(self, llm_data: LLMDataAndResult, spec: Dict):
+        if self.cache is None:
+            return None, None
+        key = self._key(llm_data, spec)
+        ret_str = self.cache.get(key)
+        if ret_str is not None:
+            logger.debug("Cache hit for %s", key)
+            llm_data.cached = True
+            return None, ret_str
+        return key, None
 
-        for role, content in result:
-            if role not in ["user", "system", "assistant"]:
-                raise BadRoleError(f"Role {role} is not valid")
-            messages.append(Message(role=role, content=content.rstrip().lstrip()))
+    @contextmanager
+    def _rate_limited(self, target: Target, llm_data: LLMDataAndResult):
+        limiter = rate_limits.get(target.provider, target.llm.model_name)
+        if limiter is None:
+            yield
+            return
+        estimated = target.llm.estimator.messages(llm_data.messages)
+        with limiter.slot(llm_data.messages, llm_data.usage, estimated):
+            yield
 
-        return messages
+    @asynccontextmanager
+    async def _arate_limited(self, target: Target, llm_data: LLMDataAndResult):
+        limiter = rate_limits.get(target.provider, target.llm.model_name)
+        if limiter is None:
+            yield
+            return
+        estimated = target.llm.estimator.messages(llm_data.messages)
+        async with limiter.aslot(llm_data.messages, llm_data.usage, estimated):
+            yield
 
     def call_llm(self, llm_data: LLMDataAndResult) -> LLMDataAndResult:
-        if self.parser.llm_schema():  # pydantic schema
-            return_scheme_llm_str = self.parser.llm_schema()
-            ret_str = self.llm.call(llm_data.messages, scheme=return_scheme_llm_str)
-        else:  # simple typings
-            return_scheme_llm_str = self.parser.llm_return_type()
-            ret_str = self.llm.call(
-                llm_data.messages, return_type=return_scheme_llm_str
-            )
+        spec = self._return_spec()
+        key, ret_str = self._from_cache(llm_data, spec)
+        if ret_str is not None:
+            return self._parse_result(llm_data, ret_str)
+        if self.single_flight is None:
+            return self._route(llm_data, spec, key)
+        shared = self.single_flight.do(
+            key or self._key(llm_data, spec),
+            lambda: self._route(llm_data, spec, key),
+        )
+        return self._follow(llm_data, shared)
+
+    async def acall_llm(self, llm_data: LLMDataAndResult) -> LLMDataAndResult:
+        spec = self._return_spec()
+        key, ret_str = self._from_cache(llm_data, spec)
+        if ret_str is not None:
+            return self._parse_result(llm_data, ret_str)
+        if self.single_flight is None:
+            return await self._aroute(llm_data, spec, key)
+        # on a copy, a cancelled leader records its error on its own data only
+        own = self._fork(llm_data)
+        shared = await self.single_flight.ado(
+            key or self._key(llm_data, spec),
+            lambda: self._aroute(own, spec, key),
+        )
+        llm_data.coalesced = shared is not own
+        return self._merge(llm_data, shared)
+
+    def _route(self, llm_data: LLMDataAndResult, spec: Dict, key) -> LLMDataAndResult:
+        if self.router is None:
+            return self._request(self.targets[0], llm_data, spec, key)
+        winner = self.router.run(
+            lambda target: self._request(target, self._fork(llm_data), spec, key)
+        )
+        return self._merge(llm_data, winner)
+
+    async def _aroute(
+        self, llm_data: LLMDataAndResult, spec: Dict, key
+    ) -> LLMDataAndResult:
+        if self.router is None:
+            return await self._arequest(self.targets[0], llm_data, spec, key)
+        winner = await self.router.arun(
+            lambda target: self._arequest(target, self._fork(llm_data), spec, key)
+        )
+        return self._merge(llm_data, winner)
+
+    def _follow(self, llm_data: LLMDataAndResult, shared: LLMDataAndResult):
+        if shared is llm_data:  # this call led the flight
+            return llm_data
+        llm_data.coalesced = True
+        return self._merge(llm_data, shared)
+
+    def _request(
+        self, target: Target, llm_data: LLMDataAndResult, spec: Dict, key
+    ) -> LLMDataAndResult:
+        while True:
+            with self._rate_limited(target, llm_data), stage("request"):
+                ret_str = target.llm.call(llm_data.messages, **spec)
+            self._parse_result(llm_data, ret_str, key, target.llm)
+            if not self._needs_repair(llm_data, key):
+                return llm_data
+
+    async def _arequest(
+        self, target: Target, llm_data: LLMDataAndResult, spec: Dict, key
+    ) -> LLMDataAndResult:
+        while True:
+            async with self._arate_limited(target, llm_data):
+                with stage("request"):
+                    ret_str = await target.llm.acall(llm_data.messages, **spec)
+            self._parse_result(llm_data, ret_str, key, target.llm)
+            if not self._needs_repair(llm_data, key):
+                return llm_data
+
+    @staticmethod
+    def _fork(llm_data: LLMDataAndResult) -> LLMDataAndResult:
+        # one per routed request, timings and usage are shared with the call
+        return LLMDataAndResult(
+            inputs=llm_data.inputs,
+            messages=llm_data.messages,
+            retries=llm_data.retries,
+            timings=llm_data.timings,
+            usage=llm_data.usage,
+        )
 
+    @staticmethod
+    def _merge(llm_data: LLMDataAndResult, winner: LLMDataAndResult):
+        for name in ("messages", "raw_result", "clean_result", "result", "error"):
+            setattr(llm_data, name, getattr(winner, name))
+        llm_data.repairs = winner.repairs
+        return llm_data
+
+    def _needs_repair(self, llm_data: LLMDataAndResult, key: Optional[str]) -> bool:
+        """Repairs an output that failed to cast, True if the LLM has to be asked.
+
+        Trivial problems are patched locally first. Otherwise, up to
+        ``repair`` times per attempt, the invalid output and a summary of
+        what is wrong with it are appended to the conversation, which is
+        cheaper than a full retry. Once exhausted the error stands and the
+        retry policy starts over.
+        """
+        if not self.repair or not isinstance(llm_data.error, FailedToCastLLMResult):
+            return False
+        with stage("repair"):
+            if self.parser.repair_result(llm_data):
+                if key:
+                    self.cache.set(key, llm_data.clean_result)
+                return False
+        if llm_data.repairs >= self.repair:
+            return False
+        llm_data.repairs += 1
+        llm_data.messages = llm_data.messages + [
+            Message(role="assistant", content=llm_data.raw_result),
+            Message(
+                role="user",
+                content=REPAIR_PROMPT.format(errors=error_summary(llm_data.error)),
+            ),
+        ]
+        llm_data.error = None
+        return True
+
+    def _parse_result(
+        self,
+        llm_data: LLMDataAndResult,
+        ret_str: str,
+        key: Optional[str] = None,
+        llm: Optional[LLM] = None,
+    ):
         llm_data.raw_result = ret_str
-        res = self.llm.clean_result(ret_str)
+        with stage("clean"):
+            res = (llm or self.llm).clean_result(ret_str)
         llm_data.clean_result = res
 
-        self.parser.cast_result(llm_data)
-        logger.debug(f"Response from llm: \n{ret_str}")
+        with stage("cast"):
+            self.parser.cast_result(llm_data)
+        logger.debug("Response from llm: \n%s", ret_str)
+        if key and not llm_data.error:
+            # cleaned, so a response from any target replays through any provider
+            self.cache.set(key, llm_data.clean_result)
         return llm_data
 
 
 class Prompter:
-    def __init__(self, llm: str, model_name: str, jinja=False, model_settings: Optional[Dict] = None):
+    def __init__(
+        self,
+        llm: str,
+        model_name: str,
+        jinja=False,
+        model_settings: Optional[Dict] = None,
+        cache: Optional[ResponseCache] = None,
+        deterministic: bool = False,
+        log_hook: Optional[Callable[[LLMDataAndResult], None]] = None,
+        instrument: Optional[Instrument] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        repair: int = 0,
+        targets: Optional[Sequence[Tuple]] = None,
+        routing: str = FALLBACK,
+        hedge_delay: Optional[float] = None,
+        target_timeout: Optional[float] = None,
+        route_workers: int = DEFAULT_WORKERS,
+        coalesce: bool = False,
+    ):
         self.model_name = model_name
         self.llm = llm
         self.jinja = jinja
         self.model_settings = model_settings
+        self.cache = cache
+        self.deterministic = deterministic
+        self.log_hook = log_hook
+        self.instrument = instrument
+        self.retry_policy = retry_policy
+        self.repair = repair
+        self.targets = targets
+        self.routing = routing
+        self.hedge_delay = hedge_delay
+        self.target_timeout = target_timeout
+        self.route_workers = route_workers
+        self.coalesce = coalesce
 
     def __call__(self, function):
         return _Pr(
@@ -105,4 +723,16 @@ class Prompter:
             llm=self.llm,
             model_name=self.model_name,
             model_settings=self.model_settings,
-        )
\ No newline at end of file
+            cache=self.cache,
+            deterministic=self.deterministic,
+            log_hook=self.log_hook,
+            instrument=self.instrument,
+            retry_policy=self.retry_policy,
+            repair=self.repair,
+            targets=self.targets,
+            routing=self.routing,
+            hedge_delay=self.hedge_delay,
+            target_timeout=self.target_timeout,
+            route_workers=self.route_workers,
+            coalesce=self.coalesce,
+        )
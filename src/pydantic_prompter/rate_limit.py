@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+from pydantic_prompter.common import Message
+from pydantic_prompter.exceptions import ProviderThrottlingError
+from pydantic_prompter.instrumentation import stage
+
+
+def estimate_tokens(messages: List[Message]) -> int:
+    # rough 4 characters per token, corrected with the reported usage later
+    return sum(len(m.content) for m in messages) // 4
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units evenly, holding at most a minute's worth.
+
+    ``reserve`` always succeeds and returns how long the caller has to wait
+    before its reservation is covered, so the same bucket serves threads
+    (``time.sleep``) and coroutines (``asyncio.sleep``).
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill()
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount: float):
+        """Takes (or with a negative amount returns) units without waiting"""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+    def utilization(self) -> float:
+        with self._lock:
+            self._refill()
+            return (self.capacity - self.level) / self.capacity
+
+
+class RateLimiter:
+    """Client side quota for one provider and model.
+
+    ``rpm`` and ``tpm`` are token buckets for requests and tokens per minute,
+    the token cost of a request is estimated from the prompt and corrected
+    with the provider-reported usage once it returns. ``max_in_flight`` caps
+    concurrent requests; the cap adapts (AIMD) by multiplying it with
+    ``decrease`` on every throttling error and growing it back by one slot
+    per window of successful calls. Works from threads and asyncio alike.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_in_flight: Optional[int] = None,
+        min_in_flight: int = 1,
+        decrease: float = 0.5,
+    ):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.decrease = decrease
+        self.limit = float(max_in_flight) if max_in_flight else None
+        self.in_flight = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._waiters: Deque[Callable[[], None]] = deque()
+
+    def _reserve(self, tokens: int) -> float:
+        delay = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def _try_enter(self, waiter: Optional[Callable[[], None]] = None) -> bool:
+        with self._lock:
+            if self.limit is None or self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            if waiter is not None:
+                self._waiters.append(waiter)
+            return False
+
+    def _discard(self, waiter: Callable[[], None]) -> bool:
+        """Removes a waiter that gave up, False if it was already woken"""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+    def _wake(self):
+        with self._lock:
+            free = len(self._waiters)
+            if self.limit is not None:
+                free = min(free, int(self.limit) - self.in_flight)
+            woken = [self._waiters.popleft() for _ in range(max(free, 0))]
+        for wake in woken:
+            wake()
+
+    def _release(self, throttled: bool):
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+            if self.limit is not None:
+                if throttled:
+                    self.limit = max(self.min_in_flight, self.limit * self.decrease)
+                else:
+                    self.limit = min(self.max_in_flight, self.limit + 1 / self.limit)
+        self._wake()
+
+    @staticmethod
+    def _used(usage: Optional[Dict[str, int]]) -> int:
+        if not usage:
+            return 0
+        return usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+
+    def _settle(self, estimated: int, usage: Optional[Dict[str, int]], before: int):
+        # usage is per call, shared by repair turns and routed requests, so
+        # only what was added while this slot was held belongs to it
+        if self.tokens:
+            actual = self._used(usage) - before
+            if actual > 0:
+                self.tokens.adjust(actual - estimated)
+
+    @contextmanager
+    def slot(
+        self,
+        messages: List[Message],
+        usage: Optional[Dict[str, int]] = None,
+        estimated: Optional[int] = None,
+    ) -> Iterator[None]:
+        """Waits for quota and a free slot, ``usage`` is read on exit.
+
+        ``estimated`` is the token cost of the request, by default estimated
+        from ``messages``.
+        """
+        if estimated is None:
+            estimated = estimate_tokens(messages)
+        with stage("queue"):
+            time.sleep(self._reserve(estimated))
+            while True:
+                event = threading.Event()
+                if self._try_enter(event.set):
+                    break
+                event.wait()
+        before = self._used(usage)
+        throttled = False
+        try:
+            yield
+        except ProviderThrottlingError:
+            throttled = True
+            raise
+        finally:
+            self._release(throttled)
+            self._settle(estimated, usage, before)
+
+    @asynccontextmanager
+    async def aslot(
+        self,
+        messages: List[Message],
+        usage: Optional[Dict[str, int]] = None,
+        estimated: Optional[int] = None,
+    ) -> AsyncIterator[None]:
+        """Async ``slot``, waits without blocking the event loop"""
+        if estimated is None:
+            estimated = estimate_tokens(messages)
+        with stage("queue"):
+            await asyncio.sleep(self._reserve(estimated))
+            loop = asyncio.get_running_loop()
+            while True:
+                future = loop.create_future()
+
+                def wake(future=future):
+                    loop.call_soon_threadsafe(
+                        lambda: future.done() or future.set_result(None)
+                    )
+
+                if self._try_enter(wake):
+                    break
+                try:
+                    await future
+                except asyncio.CancelledError:
+                    if not self._discard(wake):
+                        self._wake()  # pass on the wake-up this waiter used
+                    raise
+        before = self._used(usage)
+        throttled = False
+        try:
+            yield
+        except ProviderThrottlingError:
+            throttled = True
+            raise
+        finally:
+            self._release(throttled)
+            self._settle(estimated, usage, before)
+
+    def utilization(self) -> Dict[str, Any]:
+        """Share of each quota in use, above 1.0 means callers are queued"""
+        with self._lock:
+            stats = {
+                "in_flight": self.in_flight,
+                "limit": int(self.limit) if self.limit is not None else None,
+                "max_in_flight": self.max_in_flight,
+                "waiting": len(self._waiters),
+                "throttled": self.throttled,
+            }
+        stats["requests"] = self.requests.utilization() if self.requests else None
+        stats["tokens"] = self.tokens.utilization() if self.tokens else None
+        return stats
+
+
+class RateLimitRegistry:
+    """Process wide rate limiters keyed by provider and model name.
+
+    Every prompter calling a configured provider and model shares the same
+    limiter, so concurrent batches split one quota between them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limiters: Dict[tuple, RateLimiter] = {}
+
+    def configure(self, llm: str, model_name: str, **options) -> RateLimiter:
+        """Installs a ``RateLimiter(**options)`` for ``llm`` and ``model_name``"""
+        limiter = RateLimiter(**options)
+        with self._lock:
+            self._limiters[(llm, model_name)] = limiter
+        return limiter
+
+    def get(self, llm: str, model_name: str) -> Optional[RateLimiter]:
+        return self._limiters.get((llm, model_name))
+
+    def utilization(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {
+            f"{llm}/{model_name}": limiter.utilization()
+            for (llm, model_name), limiter in limiters.items()
+        }
+
+    def clear(self):
+        with self._lock:
+            self._limiters.clear()
+
+
+rate_limits = RateLimitRegistry()
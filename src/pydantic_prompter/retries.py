@@ -0,0 +1,109 @@
+import asyncio
+import itertools
+import random
+import time
+from typing import Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
+from pydantic_prompter.common import logger
+from pydantic_prompter.exceptions import DeadlineExceededError, Retryable
+
+T = TypeVar("T")
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Seconds from a ``Retry-After`` header, HTTP dates are ignored"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter and an optional total deadline.
+
+    Only errors that are instances of ``retry_on`` are retried: by default
+    ``Retryable``, which covers throttling (``ProviderThrottlingError``),
+    transient network and 5xx errors (``ProviderUnavailableError``) and
+    responses that failed validation (``FailedToCastLLMResult``). A
+    ``retry_after`` hint on the error is honored as the minimum delay.
+    ``deadline`` bounds the total seconds spent, including backoff; async
+    attempts are also cancelled when it runs out.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 20.0,
+        multiplier: float = 2.0,
+        jitter: bool = True,
+        deadline: Optional[float] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (Retryable,),
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = retry_on
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def next_delay(
+        self, attempt: int, error: BaseException, started: float
+    ) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up"""
+        if not isinstance(error, self.retry_on) or attempt >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt, error)
+        remaining = self.remaining(started)
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def remaining(self, started: float) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - started)
+
+    def run(self, attempt: Callable[[int], T]) -> T:
+        """Calls ``attempt(number)`` until it succeeds or the policy gives up"""
+        started = time.monotonic()
+        for number in itertools.count(1):
+            try:
+                return attempt(number)
+            except Exception as e:
+                delay = self.next_delay(number, e, started)
+                if delay is None:
+                    raise
+                logger.warning("%s, retrying in %.2f seconds...", e, delay)
+                time.sleep(delay)
+
+    async def arun(self, attempt: Callable[[int], Awaitable[T]]) -> T:
+        """Async ``run``, backs off with ``asyncio.sleep``"""
+        started = time.monotonic()
+        for number in itertools.count(1):
+            try:
+                remaining = self.remaining(started)
+                if remaining is None:
+                    return await attempt(number)
+                try:
+                    return await asyncio.wait_for(attempt(number), remaining)
+                except asyncio.TimeoutError:
+                    raise DeadlineExceededError(
+                        f"no result within the {self.deadline} seconds deadline"
+                    )
+            except Exception as e:
+                delay = self.next_delay(number, e, started)
+                if delay is None:
+                    raise
+                logger.warning("%s, retrying in %.2f seconds...", e, delay)
+                await asyncio.sleep(delay)
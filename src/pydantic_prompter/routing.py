@@ -0,0 +1,290 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pydantic_prompter.common import LLMDataAndResult, logger
+from pydantic_prompter.exceptions import ProviderUnavailableError
+from pydantic_prompter.llm_providers.base import LLM
+
+FALLBACK = "fallback"
+HEDGE = "hedge"
+DEFAULT_HEDGE_DELAY = 2.0  # until the primary has enough latency samples
+MIN_SAMPLES = 20
+DEFAULT_WORKERS = 64  # threads for sync attempts that can be abandoned
+
+
+class LatencyHistogram:
+    """Log-scale latency buckets, each about 10% wider than the previous"""
+
+    _MIN = 0.001
+    _GROWTH = 1.1
+
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds: float):
+        bucket = int(math.log(max(seconds, self._MIN) / self._MIN, self._GROWTH))
+        with self._lock:
+            self._counts[bucket] = self._counts.get(bucket, 0) + 1
+            self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the ``q`` quantile"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bucket in sorted(self._counts):
+                seen += self._counts[bucket]
+                if seen >= rank:
+                    return self._MIN * self._GROWTH ** (bucket + 1)
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Target:
+    """One provider and model a prompt can be sent to"""
+
+    def __init__(self, provider: str, llm: LLM):
+        self.provider = provider
+        self.llm = llm
+        self.latency = LatencyHistogram()
+        self.wins = 0
+        self.failures = 0
+
+    def __repr__(self):
+        return f"{self.provider}/{self.llm.model_name}"
+
+
+class Router:
+    """Sends a prompt to one of several targets, in order.
+
+    ``fallback`` tries the next target when one raises, returns an output
+    that does not cast, or takes longer than ``timeout`` seconds. ``hedge``
+    also starts the next target when the current one has not answered
+    after the hedge delay, the first valid result wins and the rest are
+    cancelled. The hedge delay is ``hedge_delay`` when given, otherwise the
+    ``hedge_quantile`` of the primary target's observed latency.
+
+    Synchronous attempts that may be abandoned run on a pool of
+    ``max_workers`` threads. Threads cannot be interrupted, so a losing or
+    timed out request keeps its worker until it returns and its result is
+    dropped; asyncio requests are cancelled. An attempt never waits for a
+    worker: when all are busy it runs on the caller's thread instead,
+    without a timeout and without hedging until a worker frees up.
+    """
+
+    def __init__(
+        self,
+        targets: List[Target],
+        mode: str = FALLBACK,
+        hedge_delay: Optional[float] = None,
+        timeout: Optional[float] = None,
+        hedge_quantile: float = 0.95,
+        max_workers: int = DEFAULT_WORKERS,
+    ):
+        self.targets = targets
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.hedge_quantile = hedge_quantile
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._idle = threading.Semaphore(max_workers)
+
+    def delay(self) -> float:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        latency = self.targets[0].latency
+        if latency.count < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return latency.quantile(self.hedge_quantile)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "target": repr(target),
+                "wins": target.wins,
+                "failures": target.failures,
+                **target.latency.snapshot(),
+            }
+            for target in self.targets
+        ]
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="prompter-route"
+                    )
+        return self._pool
+
+    def _submit(self, attempt: Callable, target: Target) -> Optional[Future]:
+        """Starts ``attempt`` on a free worker, None when all are busy"""
+        if not self._idle.acquire(blocking=False):
+            return None
+        # carry the call's recorder over so usage and stages are still counted
+        context = contextvars.copy_context()
+        future = self._executor().submit(context.run, self._timed, attempt, target)
+        future.add_done_callback(lambda _: self._idle.release())
+        return future
+
+    @staticmethod
+    def _timed(attempt: Callable, target: Target) -> LLMDataAndResult:
+        start = time.perf_counter()
+        res = attempt(target)
+        if res.error is None:
+            target.latency.record(time.perf_counter() - start)
+        return res
+
+    @staticmethod
+    async def _atimed(attempt: Callable, target: Target) -> LLMDataAndResult:
+        start = time.perf_counter()
+        res = await attempt(target)
+        if res.error is None:
+            target.latency.record(time.perf_counter() - start)
+        return res
+
+    @staticmethod
+    def _accept(target: Target, outcome) -> bool:
+        if isinstance(outcome, LLMDataAndResult) and outcome.error is None:
+            target.wins += 1
+            return True
+        target.failures += 1
+        logger.warning("%r failed: %s", target, getattr(outcome, "error", outcome))
+        return False
+
+    @staticmethod
+    def _give_up(outcome):
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def _timeout_error(self, target: Target) -> ProviderUnavailableError:
+        return ProviderUnavailableError(f"{target!r} timed out after {self.timeout}s")
+
+    def run(self, attempt: Callable[[Target], LLMDataAndResult]) -> LLMDataAndResult:
+        """Runs ``attempt(target)`` per the routing mode, returns the winner or
+        the last failure"""
+        if self.mode == HEDGE:
+            return self._hedge(attempt)
+        outcome = None
+        for target in self.targets:
+            future = None if self.timeout is None else self._submit(attempt, target)
+            try:
+                if future is None:
+                    outcome = self._timed(attempt, target)
+                else:
+                    try:
+                        outcome = future.result(self.timeout)
+                    except FutureTimeoutError:
+                        future.cancel()
+                        outcome = self._timeout_error(target)
+            except Exception as e:
+                outcome = e
+            if self._accept(target, outcome):
+                return outcome
+        return self._give_up(outcome)
+
+    def _hedge(self, attempt: Callable) -> LLMDataAndResult:
+        waiting = iter(self.targets)
+        running = {}
+        target = next(waiting)
+        outcome = None
+        while target is not None or running:
+            if target is not None:
+                future = self._submit(attempt, target)
+                if future is not None:
+                    running[future] = target
+                    target = next(waiting, None)
+                elif not running:  # no free worker and nothing to wait for
+                    try:
+                        outcome = self._timed(attempt, target)
+                    except Exception as e:
+                        outcome = e
+                    if self._accept(target, outcome):
+                        return outcome
+                    target = next(waiting, None)
+                    continue
+            # a new target starts when nobody answered within the hedge delay
+            # or one failed, a target without a free worker waits its turn
+            done, _ = wait(running, timeout=self.delay(), return_when=FIRST_COMPLETED)
+            for future in done:
+                loser = running.pop(future)
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = e
+                if self._accept(loser, outcome):
+                    for other in running:
+                        other.cancel()
+                    return outcome
+        return self._give_up(outcome)
+
+    async def arun(
+        self, attempt: Callable[[Target], Awaitable[LLMDataAndResult]]
+    ) -> LLMDataAndResult:
+        """Async ``run``, losers and timed out requests are cancelled"""
+        if self.mode == HEDGE:
+            return await self._ahedge(attempt)
+        outcome = None
+        for target in self.targets:
+            try:
+                outcome = await asyncio.wait_for(
+                    self._atimed(attempt, target), self.timeout
+                )
+            except asyncio.TimeoutError:
+                outcome = self._timeout_error(target)
+            except Exception as e:
+                outcome = e
+            if self._accept(target, outcome):
+                return outcome
+        return self._give_up(outcome)
+
+    async def _ahedge(self, attempt: Callable) -> LLMDataAndResult:
+        waiting = iter(self.targets)
+        running = {}
+        target = next(waiting)
+        running[asyncio.ensure_future(self._atimed(attempt, target))] = target
+        outcome = None
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, timeout=self.delay(), return_when=asyncio.FIRST_COMPLETED
+                )
+                launch = not done
+                for task in done:
+                    target = running.pop(task)
+                    try:
+                        outcome = task.result()
+                    except Exception as e:
+                        outcome = e
+                    if self._accept(target, outcome):
+                        return outcome
+                    launch = True
+                if launch:
+                    target = next(waiting, None)
+                    if target is not None:
+                        task = asyncio.ensure_future(self._atimed(attempt, target))
+                        running[task] = target
+        finally:
+            for task in running:
+                task.cancel()
+        return self._give_up(outcome)
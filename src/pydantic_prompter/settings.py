@@ -29,12 +29,15 @@ class TemplatePaths(BaseModel):
 class Settings(BaseSettings):
     openai_api_key: Optional[str] = None
     template_paths: TemplatePaths = TemplatePaths()
+    template_bytecode_cache_dir: Optional[str] = None
     aws_default_region: str = "us-east-1"
     aws_profile: Optional[str] = None
     aws_access_key_id: Optional[str] = None
     aws_secret_access_key: Optional[str] = None
     aws_session_token: Optional[str] = None
     cohere_key: Optional[str] = None
+    # mark the fixed instructions and schema for provider side prompt caching
+    prompt_cache: bool = True
     model_config = SettingsConfigDict(
         env_file=find_dotenv(), env_nested_delimiter="__", extra="ignore"
     )
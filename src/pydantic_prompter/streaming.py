@@ -0,0 +1,85 @@
+import json
+from typing import Any, Dict, List, Optional
+
+
+class JsonStreamParser:
+    """Incremental scanner for the top-level JSON object of a streamed reply.
+
+    Text before the first ``{`` (code fences, xml tags, chatter) is skipped.
+    The scanner tracks string and nesting state so it knows when a top-level
+    member is complete, which lets ``fields`` return every finished field
+    while the rest of the object is still being generated, and it marks the
+    stream ``complete`` as soon as the object closes.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._length = 0
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._safe: Optional[int] = None
+        self._fields: Dict[str, Any] = {}
+        self._fields_at: Optional[int] = None
+        self.end: Optional[int] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    @property
+    def text(self) -> str:
+        """Everything received, cut right after the top-level object closes"""
+        text = "".join(self._chunks)
+        self._chunks = [text]
+        return text[: self.end] if self.complete else text
+
+    def feed(self, chunk: str) -> bool:
+        """Consumes a chunk, returns True when new top-level fields completed"""
+        if self.complete or not chunk:
+            return False
+        offset = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+
+        for i, char in enumerate(chunk, offset):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._start is None:
+                if char == "{":
+                    self._start = i
+                    self._depth = 1
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = self._safe = i + 1
+                    break
+            elif char == "," and self._depth == 1:
+                self._safe = i
+        return self._safe is not None and self._safe != self._fields_at
+
+    def fields(self) -> Dict[str, Any]:
+        """The completed top-level fields received so far"""
+        if self._safe is None or self._safe == self._fields_at:
+            return self._fields
+        text = "".join(self._chunks)
+        self._chunks = [text]
+        partial = text[self._start : self._safe]
+        if not self.complete:
+            partial += "}"
+        try:
+            self._fields = json.loads(partial, strict=False)
+        except json.JSONDecodeError:
+            pass
+        self._fields_at = self._safe
+        return self._fields
@@ -0,0 +1,58 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache, Template
+from jinja2 import TemplateNotFound
+
+from pydantic_prompter.common import get_settings
+
+
+class _PathLoader(BaseLoader):
+    """Loads templates by absolute or relative file path.
+
+    A cached template is reused until the file's mtime changes.
+    """
+
+    def get_source(self, environment: Environment, template: str):
+        try:
+            mtime = os.path.getmtime(template)
+            with open(template) as f:
+                source = f.read()
+        except OSError:
+            raise TemplateNotFound(template)
+
+        def uptodate() -> bool:
+            try:
+                return os.path.getmtime(template) == mtime
+            except OSError:
+                return False
+
+        return source, os.path.abspath(template), uptodate
+
+
+def _bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    settings = get_settings()
+    if not settings.template_bytecode_cache_dir:
+        return None
+    os.makedirs(settings.template_bytecode_cache_dir, exist_ok=True)
+    return FileSystemBytecodeCache(settings.template_bytecode_cache_dir)
+
+
+@lru_cache(maxsize=None)
+def environment() -> Environment:
+    """Built on the first template, so importing this reads no settings"""
+    return Environment(
+        loader=_PathLoader(),
+        keep_trailing_newline=True,
+        auto_reload=True,
+        bytecode_cache=_bytecode_cache(),
+    )
+
+
+def file_template(path: str) -> Template:
+    return environment().get_template(path)
+
+
+def string_template(source: str) -> Template:
+    return environment().from_string(source)
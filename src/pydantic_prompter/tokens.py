@@ -0,0 +1,151 @@
+import math
+from typing import Any, Dict, List, Optional
+
+from pydantic_prompter.common import Message
+
+SCALAR_TOKENS = 8
+MIN_OUTPUT_TOKENS = 256
+OUTPUT_MARGIN = 1.5
+INSTRUCTION_TOKENS = 150  # the fixed instructions providers wrap prompts in
+
+# first match wins, so longer names go before their prefixes
+CONTEXT_WINDOWS = (
+    ("gpt-4o", 128_000),
+    ("gpt-4-turbo", 128_000),
+    ("gpt-4-1106", 128_000),
+    ("gpt-4-0125", 128_000),
+    ("gpt-4-32k", 32_768),
+    ("gpt-4", 8_192),
+    ("gpt-3.5-turbo-instruct", 4_096),
+    ("gpt-3.5-turbo", 16_385),
+    ("anthropic.claude-3", 200_000),
+    ("anthropic.claude-v2:1", 200_000),
+    ("anthropic.claude", 100_000),
+    ("meta.llama2", 4_096),
+    ("meta.llama3", 8_192),
+    ("command-r", 128_000),
+    ("command", 4_096),
+)
+
+
+def context_window(model_name: str) -> Optional[int]:
+    """Prompt plus output tokens the model accepts, None when unknown"""
+    for name, size in CONTEXT_WINDOWS:
+        if name in model_name:
+            return size
+    return None
+
+
+class TokenEstimator:
+    """Counts tokens locally from characters, without a tokenizer.
+
+    ``chars_per_token`` is the average for the model family's tokenizer on
+    English and JSON, ``per_message`` the tokens each chat message adds for
+    its role and separators. Estimates are compared with the provider's
+    counts in ``llm_data.usage``.
+    """
+
+    def __init__(self, chars_per_token: float = 4.0, per_message: int = 4):
+        self.chars_per_token = chars_per_token
+        self.per_message = per_message
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def messages(self, messages: List[Message]) -> int:
+        return sum(self.count(m.content) + self.per_message for m in messages)
+
+    def schema(
+        self, schema: Dict[str, Any], defs: Optional[Dict[str, Any]] = None
+    ) -> Optional[int]:
+        """Upper estimate of the tokens in a JSON value matching ``schema``.
+
+        None when the schema has no upper bound, i.e. a string, list or dict
+        without ``max_length``, an ``Any`` field or a recursive model.
+        """
+        return self._value(schema, defs or schema.get("$defs", {}), set())
+
+    def _value(
+        self, schema: Dict[str, Any], defs: Dict[str, Any], seen: set
+    ) -> Optional[int]:
+        if "$ref" in schema:
+            name = schema["$ref"].split("/")[-1]
+            if name in seen:  # recursive model
+                return None
+            return self._value(defs[name], defs, seen | {name})
+        if "const" in schema:
+            return SCALAR_TOKENS
+        if "enum" in schema:
+            longest = max((len(str(v)) for v in schema["enum"]), default=0)
+            return math.ceil(longest / self.chars_per_token) + 2
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                options = [self._value(s, defs, seen) for s in schema[key]]
+                return None if None in options else max(options)
+        if "allOf" in schema:
+            parts = [self._value(s, defs, seen) for s in schema["allOf"]]
+            return None if None in parts else sum(parts)
+
+        kind = schema.get("type")
+        if isinstance(kind, list):
+            kind = next((k for k in kind if k != "null"), "null")
+        if kind == "object" or (kind is None and "properties" in schema):
+            tokens = 2
+            for name, prop in schema.get("properties", {}).items():
+                value = self._value(prop, defs, seen)
+                if value is None:
+                    return None
+                tokens += self.count(name) + 3 + value
+            extra = schema.get("additionalProperties", False)
+            if extra is not False:
+                if "maxProperties" not in schema or not isinstance(extra, dict):
+                    return None
+                value = self._value(extra, defs, seen)
+                if value is None:
+                    return None
+                tokens += schema["maxProperties"] * (SCALAR_TOKENS + value)
+            return tokens
+        if kind == "array":
+            items = schema.get("items")
+            if "maxItems" not in schema or items is None:
+                return None
+            item = self._value(items, defs, seen)
+            if item is None:
+                return None
+            return schema["maxItems"] * (item + 1) + 2
+        if kind == "string":
+            if "maxLength" not in schema:
+                return None
+            # escapes and rare characters split into more tokens
+            return math.ceil(schema["maxLength"] / self.chars_per_token * 1.5) + 2
+        if kind in ("integer", "number", "boolean", "null"):
+            return SCALAR_TOKENS
+        return None  # Any
+
+
+def output_budget(
+    estimator: TokenEstimator,
+    scheme: Optional[dict],
+    return_type: Optional[str],
+    cap: Optional[int],
+) -> Optional[int]:
+    """``max_tokens`` for a response, sized from the return schema.
+
+    Only tightened when every string, list and dict in the schema has a
+    ``max_length``, anything unbounded gets ``cap`` so long answers are not
+    cut off, None when the provider has no cap of its own. A margin on top
+    covers whitespace and wrapper tags, and the budget stays between
+    ``MIN_OUTPUT_TOKENS`` and ``cap``.
+    """
+    if scheme:
+        tokens = estimator.schema(scheme["parameters"])
+    elif return_type == "str":
+        tokens = None
+    else:
+        tokens = SCALAR_TOKENS
+    if tokens is None:
+        return cap
+    budget = math.ceil(tokens * OUTPUT_MARGIN)
+    if cap is not None:
+        budget = min(cap, budget)
+    return max(MIN_OUTPUT_TOKENS, budget)
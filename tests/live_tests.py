@@ -7,6 +7,7 @@ from pydantic_prompter.exceptions import (
     CohereAuthenticationError,
     OpenAiAuthenticationError,
     BedRockAuthenticationError,
+    ProviderUnavailableError,
 )
 from tests.data_for_tests import *
 
@@ -47,6 +48,7 @@ def test_pydantic_result(llm, model):
         OpenAiAuthenticationError,
         BedRockAuthenticationError,
         CohereAuthenticationError,
+        ProviderUnavailableError,
     ):
         print(bbb.build_string())
         logger.exception("")
@@ -134,6 +136,7 @@ def test_str_result(llm, model):
         OpenAiAuthenticationError,
         BedRockAuthenticationError,
         CohereAuthenticationError,
+        ProviderUnavailableError,
     ):
         print(bbb.build_string())
         logger.exception("")
@@ -159,6 +162,7 @@ def test_int_result(llm, model):
         OpenAiAuthenticationError,
         BedRockAuthenticationError,
         CohereAuthenticationError,
+        ProviderUnavailableError,
     ):
         print(bbb.build_string())
         logger.exception("")
@@ -184,6 +188,7 @@ def test_bool_result(llm, model):
         OpenAiAuthenticationError,
         BedRockAuthenticationError,
         CohereAuthenticationError,
+        ProviderUnavailableError,
     ):
         print(bbb.build_string())
         logger.exception("")